@@ -0,0 +1,263 @@
+#coding: utf-8
+'''
+End-to-end benchmark of the SFA harvest pipeline
+
+Generates synthetic SFA workbooks, serves them and the dataset files from
+an in-process fake S3 bucket and runs gather_stage, fetch_stage and
+import_stage of SFAHarvester against the CKAN database of the given config
+file, then gathers again with the unchanged workbook. Use a throwaway
+database, the benchmark creates a harvest source per run and does not
+clean up.
+
+Every workbook size runs in its own process so the peak RSS is measured per
+size. The results are printed as JSON.
+
+Usage:
+
+    python bench/harvest_pipeline.py --config=/path/to/test.ini \\
+        [--rows=100,1000,10000] [--files=3] [--vocabulary=500]
+'''
+
+import os
+import sys
+import json
+import time
+import hashlib
+import resource
+import tempfile
+import optparse
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic  # noqa
+
+
+class FakeKey(object):
+    '''
+    A file in the fake bucket with the attributes of a listed boto key
+    '''
+
+    def __init__(self, bucket, key, data=''):
+        self.bucket = bucket
+        self.key = self.name = key
+        self.data = data
+        self.size = len(data)
+        self.etag = '"%s"' % hashlib.md5(data).hexdigest()
+        self.last_modified = datetime.utcnow().strftime(
+            '%Y-%m-%dT%H:%M:%S.000Z'
+        )
+
+    def get_contents_to_filename(self, file_path, headers=None):
+        # Like boto, the file is created first and removed on any error,
+        # including the 304 of an unchanged file
+        target = open(file_path, 'wb')
+        try:
+            self.get_contents_to_file(target, headers)
+        except Exception:
+            target.close()
+            os.remove(file_path)
+            raise
+        target.close()
+
+    def get_contents_to_file(self, target, headers=None):
+        self.bucket.requests += 1
+        stored = self.bucket.keys[self.key]
+        if headers and headers.get('If-None-Match') == stored.etag:
+            from boto.exception import S3ResponseError
+            raise S3ResponseError(304, 'Not Modified')
+        self.bucket.downloads += 1
+        target.write(stored.data)
+        self.etag = stored.etag
+
+
+class FakeBucket(object):
+    '''
+    An in-process stand-in for the boto bucket used by the harvester,
+    listing returns pages of 1000 keys like S3
+    '''
+
+    def __init__(self):
+        self.keys = {}
+        self.requests = 0
+        self.downloads = 0
+
+    def add(self, key, data):
+        self.keys[key] = FakeKey(self, key, data)
+
+    def new_key(self, key):
+        return FakeKey(self, key)
+
+    def list(self, prefix=''):
+        keys = sorted(key for key in self.keys if key.startswith(prefix))
+        for offset in range(0, max(len(keys), 1), 1000):
+            self.requests += 1
+            for key in keys[offset:offset + 1000]:
+                yield self.keys[key]
+
+
+def build_bucket(workbook_path, rows, files):
+    from ckanext.sfa.harvesters.sfaharvester import SFAHarvester
+    bucket = FakeBucket()
+    with open(workbook_path, 'rb') as workbook:
+        bucket.add(SFAHarvester.METADATA_FILE_NAME, workbook.read())
+    for row_num in range(rows):
+        prefix = SFAHarvester.DEPARTMENT_BASE + synthetic.dataset_id(row_num)
+        for file_num in range(files):
+            bucket.add(
+                u'%s/file%d.csv' % (prefix, file_num),
+                'id,value\n%d,%d\n' % (row_num, file_num)
+            )
+    return bucket
+
+
+def load_config(config_path):
+    from paste.deploy import appconfig
+    from ckan.config.environment import load_environment
+    conf = appconfig('config:' + os.path.abspath(config_path))
+    load_environment(conf.global_conf, conf.local_conf)
+
+
+def setup_harvest(run_name):
+    from ckan import model
+    from ckanext.harvest.model import setup, HarvestSource
+
+    setup()
+    if not model.User.get(u'harvest'):
+        model.Session.add(model.User(name=u'harvest', sysadmin=True))
+        model.Session.commit()
+
+    source = HarvestSource(url=u'http://bench/%s' % run_name, type=u'sfa')
+    source.save()
+    return new_job(source)
+
+
+def new_job(source):
+    from ckanext.harvest.model import HarvestJob
+
+    job = HarvestJob(source=source)
+    job.save()
+    return job
+
+
+def run_gather(harvester, job):
+    ids = harvester.gather_stage(job)
+    if ids is False:
+        raise Exception('Gather stage failed: %s' % [
+            error.message for error in job.gather_errors
+        ])
+    return ids
+
+
+def run_size(options):
+    '''
+    Run the whole pipeline for one workbook size and print the results
+    '''
+    load_config(options.config)
+
+    from pylons import config
+    from ckan import model
+    from ckanext.harvest.model import HarvestObject
+    from ckanext.sfa.harvesters import sfaharvester, stats
+
+    # Start with an empty cache, the first gather downloads the workbook
+    config['ckanext.sfa.cache_dir'] = tempfile.mkdtemp()
+
+    workbook_path = os.path.join(tempfile.mkdtemp(), 'workbook.xlsx')
+    synthetic.write_workbook(workbook_path, options.size, options.vocabulary)
+    bucket = build_bucket(workbook_path, options.size, options.files)
+
+    # Collect the stats the harvester emits
+    emitted = []
+    emit = stats.SFAHarvestStats.emit
+
+    def record_stats(harvest_stats):
+        emitted.append(harvest_stats.to_dict())
+        emit(harvest_stats)
+    stats.SFAHarvestStats.emit = record_stats
+
+    harvester = sfaharvester.SFAHarvester()
+    harvester._get_s3_bucket = lambda: bucket
+
+    job = setup_harvest('%d-%d' % (options.size, time.time()))
+    timings = {}
+
+    start = time.time()
+    ids = run_gather(harvester, job)
+    timings['gather'] = time.time() - start
+
+    timings['fetch'] = 0.0
+    timings['import'] = 0.0
+    for object_id in ids:
+        harvest_object = HarvestObject.get(object_id)
+
+        start = time.time()
+        harvester.fetch_stage(harvest_object)
+        timings['fetch'] += time.time() - start
+
+        start = time.time()
+        harvester.import_stage(harvest_object)
+        timings['import'] += time.time() - start
+        model.Session.remove()
+
+    # Emitted after the last object already, unless some failed
+    sfaharvester.SFAHarvester.flush_job_stats()
+
+    total = sum(timings.values())
+
+    # Gather again like the next scheduled job, the metadata file is
+    # unchanged and its cached copy is used
+    downloads = bucket.downloads
+    start = time.time()
+    regather_ids = run_gather(harvester, new_job(job.source))
+    timings['regather'] = time.time() - start
+    if bucket.downloads != downloads:
+        raise Exception('The unchanged metadata file was downloaded again')
+    print json.dumps({
+        'rows': options.size,
+        'files_per_dataset': options.files,
+        'harvest_objects': len(ids),
+        'regather_harvest_objects': len(regather_ids),
+        'seconds': dict(
+            (stage, round(seconds, 3)) for stage, seconds in timings.items()
+        ),
+        'datasets_per_second': round(len(ids) / total, 2) if total else None,
+        's3_requests': bucket.requests,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stats': emitted,
+    })
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--config', help='CKAN config file of a throwaway DB')
+    parser.add_option('--rows', default='100,1000,10000')
+    parser.add_option('--files', type='int', default=3)
+    parser.add_option('--vocabulary', type='int', default=500)
+    parser.add_option('--size', type='int', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if not options.config:
+        parser.error('Please provide a CKAN config file with --config')
+
+    if options.size:
+        run_size(options)
+        return
+
+    results = []
+    for size in [int(rows) for rows in options.rows.split(',')]:
+        output = subprocess.check_output([
+            sys.executable, __file__,
+            '--config=%s' % options.config,
+            '--size=%d' % size,
+            '--files=%d' % options.files,
+            '--vocabulary=%d' % options.vocabulary,
+        ])
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print json.dumps({'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#coding: utf-8
+'''
+Import-time benchmark of the SFA harvester
+
+Measures what importing the harvester costs a process which loads the
+plugin but never harvests, like a CKAN web worker. Every module is
+imported in a fresh process, which reports the wall time of the import,
+the RSS it added and which heavy dependencies it loaded. The harvest
+base class is measured on its own as well, as every harvester pays for
+it. The results are printed as JSON.
+
+Usage:
+
+    python bench/import_time.py [--repeat=5]
+'''
+
+import os
+import sys
+import json
+import optparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODULES = [
+    'ckanext.harvest.harvesters.base',
+    'ckanext.sfa.harvesters',
+]
+
+HEAVY_MODULES = [
+    'boto',
+    'xlrd',
+    'multiprocessing',
+    'ckanext.harvest.model',
+]
+
+MEASURE = '''
+import sys, time, json, resource
+sys.path.insert(0, %(path)r)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+__import__(%(module)r)
+print json.dumps({
+    'seconds': time.time() - start,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    'loaded': [name for name in %(heavy)r if name in sys.modules],
+})
+'''
+
+
+def measure(module):
+    '''
+    Import a module in a new process and return its measurements
+    '''
+    code = MEASURE % {
+        'path': os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'module': module,
+        'heavy': HEAVY_MODULES,
+    }
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=5)
+    options, args = parser.parse_args()
+
+    results = []
+    for module in args or MODULES:
+        runs = [measure(module) for i in range(options.repeat)]
+        results.append({
+            'module': module,
+            'best_seconds': round(min(run['seconds'] for run in runs), 4),
+            'rss_kb': min(run['rss_kb'] for run in runs),
+            'loaded': runs[0]['loaded'],
+        })
+    print json.dumps({'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#coding: utf-8
+'''
+CPU benchmark of the tag and name normalisation of the SFA harvester
+
+Generates the term translations and the names of synthetic datasets,
+once with the memoised normalisation of SFAHarvester and once calling
+munge_tag and munge_title_to_name for every tag and title, and reports
+the CPU time of both per vocabulary size as JSON.
+
+Usage:
+
+    python bench/normalize.py [--rows=10000] [--vocabulary=500,5000,50000]
+'''
+
+import os
+import sys
+import json
+import time
+import optparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic  # noqa
+
+
+class Uncached(object):
+    '''
+    Stands in for the LRU cache of the harvester, computing every value
+    '''
+
+    def get(self, key, compute):
+        return compute(key)
+
+
+def build_rows(row_count, vocabulary_size):
+    return [
+        dict(
+            (lang_code, dict(zip(
+                synthetic.HEADER,
+                synthetic.dataset_row(row_num, lang_code, vocabulary_size)
+            )))
+            for lang_code in synthetic.LANG_CODES
+        )
+        for row_num in range(row_count)
+    ]
+
+
+def normalize_all(harvester, datasets):
+    '''
+    Run the normalisation of gather and import for every dataset
+    '''
+    for rows in datasets:
+        harvester._generate_dataset_translations(rows)
+        harvester._normalize_name(rows['de'][u'title'])
+        harvester._normalize_name(rows['de'][u'groups'])
+        harvester._normalize_name(harvester.ORGANIZATION['de']['name'])
+
+
+def measure(harvester, datasets):
+    start = time.clock()
+    normalize_all(harvester, datasets)
+    return time.clock() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rows', type='int', default=10000)
+    parser.add_option('--vocabulary', default='500,5000,50000')
+    options, args = parser.parse_args()
+
+    from ckanext.sfa.harvesters.sfaharvester import SFAHarvester
+
+    results = []
+    vocabulary_sizes = [int(size) for size in options.vocabulary.split(',')]
+    for vocabulary_size in vocabulary_sizes:
+        datasets = build_rows(options.rows, vocabulary_size)
+
+        uncached = SFAHarvester()
+        uncached._tag_cache = uncached._name_cache = Uncached()
+        uncached_seconds = measure(uncached, datasets)
+
+        SFAHarvester._tag_cache.clear()
+        SFAHarvester._name_cache.clear()
+        cached = SFAHarvester()
+        cached_seconds = measure(cached, datasets)
+
+        results.append({
+            'rows': options.rows,
+            'vocabulary_size': vocabulary_size,
+            'uncached_cpu_seconds': round(uncached_seconds, 3),
+            'cached_cpu_seconds': round(cached_seconds, 3),
+            'speedup': round(uncached_seconds / cached_seconds, 2)
+            if cached_seconds else None,
+            'tag_cache': SFAHarvester._tag_cache.info(),
+            'name_cache': SFAHarvester._name_cache.info(),
+        })
+    print json.dumps({'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#coding: utf-8
+'''
+Generates synthetic SFA metadata workbooks for the benchmarks
+
+The workbooks have the layout of "OGD@Bund Metadaten BAR.xlsx": one sheet
+per language (de, fr, it, en), the header on row 7 and the datasets from
+row 8 on. They are written with the standard library only, using shared
+strings like Excel does.
+'''
+
+import zipfile
+from xml.sax.saxutils import escape
+
+LANG_CODES = ['de', 'fr', 'it', 'en']
+
+HEADER = [
+    u'id',
+    u'title',
+    u'url',
+    u'notes',
+    u'author',
+    u'maintainer',
+    u'maintainer_email',
+    u'licence',
+    u'licence_url',
+    u'tags',
+    u'groups',
+    u'version',
+]
+
+XML_DECLARATION = (
+    u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+)
+
+CONTENT_TYPES = XML_DECLARATION + (
+    u'<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    u'content-types">'
+    u'<Default Extension="rels" ContentType="'
+    u'application/vnd.openxmlformats-package.relationships+xml"/>'
+    u'<Default Extension="xml" ContentType="application/xml"/>'
+    u'<Override PartName="/xl/workbook.xml" ContentType="'
+    u'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+    u'sheet.main+xml"/>'
+    u'<Override PartName="/xl/sharedStrings.xml" ContentType="'
+    u'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+    u'sharedStrings+xml"/>'
+    u'%(sheets)s'
+    u'</Types>'
+)
+
+SHEET_CONTENT_TYPE = (
+    u'<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="'
+    u'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+    u'worksheet+xml"/>'
+)
+
+ROOT_RELS = XML_DECLARATION + (
+    u'<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+    u'2006/relationships">'
+    u'<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    u'officeDocument/2006/relationships/officeDocument" '
+    u'Target="xl/workbook.xml"/>'
+    u'</Relationships>'
+)
+
+WORKBOOK = XML_DECLARATION + (
+    u'<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    u'2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+    u'officeDocument/2006/relationships">'
+    u'<sheets>%(sheets)s</sheets>'
+    u'</workbook>'
+)
+
+WORKBOOK_RELS = XML_DECLARATION + (
+    u'<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+    u'2006/relationships">'
+    u'%(sheets)s'
+    u'<Relationship Id="rIdStrings" Type="http://schemas.openxmlformats.org/'
+    u'officeDocument/2006/relationships/sharedStrings" '
+    u'Target="sharedStrings.xml"/>'
+    u'</Relationships>'
+)
+
+SHEET_REL = (
+    u'<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/'
+    u'officeDocument/2006/relationships/worksheet" '
+    u'Target="worksheets/sheet%d.xml"/>'
+)
+
+
+def dataset_id(row_num):
+    return u'dataset%06d' % row_num
+
+
+def tags(row_num, lang_code, vocabulary_size):
+    return [
+        u'%s tag %d' % (lang_code, (row_num * 7 + i) % vocabulary_size)
+        for i in range(3)
+    ]
+
+
+def dataset_row(row_num, lang_code, vocabulary_size=500):
+    '''
+    Return the values of a synthetic dataset row
+    '''
+    return [
+        dataset_id(row_num),
+        u'%s Titel des Datensatzes %d' % (lang_code, row_num),
+        u'http://www.bar.admin.ch/%d' % row_num,
+        u'%s Beschreibung des Datensatzes %d. ' % (lang_code, row_num) * 5,
+        u'%s Bundesarchiv' % lang_code,
+        u'%s Bundesarchiv' % lang_code,
+        u'ogd@bar.admin.ch',
+        u'%s Lizenz' % lang_code,
+        u'http://www.bar.admin.ch/licence',
+        u', '.join(tags(row_num, lang_code, vocabulary_size)),
+        u'%s Gruppe %d' % (lang_code, row_num % 10),
+        float(row_num % 5 + 1),
+    ]
+
+
+class SharedStrings(object):
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def get(self, value):
+        if value not in self.index:
+            self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return self.index[value]
+
+    def to_xml(self):
+        items = u''.join(
+            u'<si><t>%s</t></si>' % escape(value) for value in self.strings
+        )
+        return (
+            u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            u'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+            u'2006/main" count="%d" uniqueCount="%d">%s</sst>'
+            % (len(self.strings), len(self.strings), items)
+        )
+
+
+def _column_name(col_index):
+    name = u''
+    col_index += 1
+    while col_index:
+        col_index, remainder = divmod(col_index - 1, 26)
+        name = unichr(ord('A') + remainder) + name
+    return name
+
+
+def _row_xml(row_num, values, shared_strings):
+    cells = []
+    for col_index, value in enumerate(values):
+        reference = u'%s%d' % (_column_name(col_index), row_num + 1)
+        if isinstance(value, float):
+            cells.append(u'<c r="%s"><v>%r</v></c>' % (reference, value))
+        else:
+            cells.append(
+                u'<c r="%s" t="s"><v>%d</v></c>'
+                % (reference, shared_strings.get(value))
+            )
+    return u'<row r="%d">%s</row>' % (row_num + 1, u''.join(cells))
+
+
+def write_workbook(file_path, row_count, vocabulary_size=500):
+    '''
+    Write a synthetic SFA workbook with the given number of datasets
+    '''
+    shared_strings = SharedStrings()
+    archive = zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        for sheet_num, lang_code in enumerate(LANG_CODES, 1):
+            rows = [
+                _row_xml(0, [u'OGD@Bund Metadaten BAR %s' % lang_code],
+                         shared_strings),
+                _row_xml(6, HEADER, shared_strings),
+            ]
+            for row_num in range(row_count):
+                rows.append(_row_xml(
+                    row_num + 7,
+                    dataset_row(row_num, lang_code, vocabulary_size),
+                    shared_strings
+                ))
+            sheet = (
+                u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                u'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                u'spreadsheetml/2006/main"><sheetData>%s</sheetData>'
+                u'</worksheet>' % u''.join(rows)
+            )
+            archive.writestr(
+                'xl/worksheets/sheet%d.xml' % sheet_num,
+                sheet.encode('utf-8')
+            )
+
+        sheet_nums = range(1, len(LANG_CODES) + 1)
+        archive.writestr('[Content_Types].xml', (CONTENT_TYPES % {
+            'sheets': u''.join(SHEET_CONTENT_TYPE % n for n in sheet_nums)
+        }).encode('utf-8'))
+        archive.writestr('_rels/.rels', ROOT_RELS.encode('utf-8'))
+        archive.writestr('xl/workbook.xml', (WORKBOOK % {
+            'sheets': u''.join(
+                u'<sheet name="%s" sheetId="%d" r:id="rId%d"/>'
+                % (lang_code, n, n)
+                for n, lang_code in zip(sheet_nums, LANG_CODES)
+            )
+        }).encode('utf-8'))
+        archive.writestr('xl/_rels/workbook.xml.rels', (WORKBOOK_RELS % {
+            'sheets': u''.join(SHEET_REL % (n, n) for n in sheet_nums)
+        }).encode('utf-8'))
+        archive.writestr(
+            'xl/sharedStrings.xml',
+            shared_strings.to_xml().encode('utf-8')
+        )
+    finally:
+        archive.close()
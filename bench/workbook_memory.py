@@ -0,0 +1,111 @@
+#coding: utf-8
+'''
+Memory benchmark for reading the SFA metadata workbook
+
+Compares the peak RSS of loading all four language sheets with xlrd,
+like the harvester used to, with streaming them side by side through
+SFAWorkbook. The synthetic workbook and each reader are written and run
+in their own process, as the peak RSS is inherited across fork and exec.
+
+Usage: python bench/workbook_memory.py [--rows=50000] [--workbook=PATH]
+'''
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import optparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic  # noqa
+
+
+def read_with_xlrd(file_path):
+    import xlrd
+    workbook = xlrd.open_workbook(file_path)
+    count = 0
+    for sheet_index in range(len(synthetic.LANG_CODES)):
+        worksheet = workbook.sheet_by_index(sheet_index)
+        header_row = worksheet.row_values(6)
+        rows = []
+        for row_num in range(7, worksheet.nrows):
+            rows.append(dict(zip(header_row, worksheet.row_values(row_num))))
+        count += len(rows)
+    return count
+
+
+def read_streaming(file_path):
+    from ckanext.sfa.harvesters.workbook import SFAWorkbook
+    workbook = SFAWorkbook(file_path, synthetic.LANG_CODES)
+    count = 0
+    for rows in workbook.iter_datasets():
+        count += len([row for row in rows.values() if row is not None])
+    return count
+
+
+READERS = {
+    'xlrd': read_with_xlrd,
+    'streaming': read_streaming,
+}
+
+
+def run_reader(mode, file_path):
+    start = time.time()
+    count = READERS[mode](file_path)
+    print json.dumps({
+        'reader': mode,
+        'rows': count,
+        'seconds': round(time.time() - start, 3),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rows', type='int', default=50000)
+    parser.add_option('--workbook', default=None)
+    parser.add_option('--reader', default=None, help=optparse.SUPPRESS_HELP)
+    parser.add_option(
+        '--generate',
+        action='store_true',
+        help=optparse.SUPPRESS_HELP
+    )
+    options, args = parser.parse_args()
+
+    if options.reader:
+        run_reader(options.reader, options.workbook)
+        return
+    if options.generate:
+        synthetic.write_workbook(options.workbook, options.rows)
+        return
+
+    # The workbook is generated in its own process as well, on Linux
+    # ru_maxrss is inherited by the reader processes
+    file_path = options.workbook
+    if file_path is None:
+        file_path = os.path.join(tempfile.mkdtemp(), 'workbook.xlsx')
+        subprocess.check_call([
+            sys.executable, __file__,
+            '--generate',
+            '--rows=%d' % options.rows,
+            '--workbook=%s' % file_path
+        ])
+
+    results = []
+    for mode in sorted(READERS):
+        output = subprocess.check_output([
+            sys.executable, __file__,
+            '--reader=%s' % mode,
+            '--workbook=%s' % file_path
+        ])
+        results.append(json.loads(output))
+    print json.dumps({'workbook': file_path, 'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    main()
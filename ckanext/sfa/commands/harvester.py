@@ -1,12 +1,77 @@
 import sys
 import re
+import json
+import time
+import signal
+import multiprocessing
+import threading
+import logging
 from pprint import pprint
 
 from ckan import model
 from ckan.logic import get_action, ValidationError
+from ckan.plugins import PluginImplementations
 
 from ckan.lib.cli import CkanCommand
 
+log = logging.getLogger(__name__)
+
+SEGMENTS = '0123456789abcdef'
+
+
+# Objects imported by the current task of an import worker process
+_task_progress = {'imported': 0}
+
+
+def _counted(import_stage):
+    def counted_import_stage(harvest_object):
+        result = import_stage(harvest_object)
+        _task_progress['imported'] += 1
+        return result
+    return counted_import_stage
+
+
+def _init_import_worker():
+    '''
+    Prepare a worker process of harvester import --parallel
+    '''
+    from ckanext.harvest.interfaces import IHarvester
+
+    # Use connections of this process only
+    model.Session.remove()
+    model.meta.engine.dispose()
+
+    # harvest_objects_import only returns the imported objects once all
+    # are done, they are counted as well to report the ones imported
+    # before a failure
+    for harvester in PluginImplementations(IHarvester):
+        harvester.import_stage = _counted(harvester.import_stage)
+
+
+def _import_segment(task):
+    '''
+    Import one harvest object segment, run in a worker
+    process of harvester import --parallel
+    '''
+    source_id, segment, join_datasets, user = task
+    start = time.time()
+    _task_progress['imported'] = 0
+
+    try:
+        context = {'model': model, 'session': model.Session, 'user': user,
+                   'join_datasets': join_datasets, 'segments': segment}
+        objs = get_action('harvest_objects_import')(context, {'source_id': source_id})
+        return {'segment': segment, 'count': len(objs), 'error': None,
+                'seconds': time.time() - start}
+    except Exception, e:
+        log.exception(e)
+        model.Session.rollback()
+        return {'segment': segment, 'count': _task_progress['imported'],
+                'error': str(e), 'seconds': time.time() - start}
+    finally:
+        model.Session.remove()
+
+
 class Harvester(CkanCommand):
     '''Harvests remotely mastered metadata
 
@@ -34,16 +99,28 @@ class Harvester(CkanCommand):
       harvester run
         - runs harvest jobs
 
-      harvester gather_consumer
+      harvester [--workers={workers}] gather_consumer
         - starts the consumer for the gathering queue
 
-      harvester fetch_consumer
+      harvester [--workers={workers}] fetch_consumer
         - starts the consumer for the fetching queue
 
+          The --workers flag allows to run several consumers in threads of the
+          same process, each with its own queue connection and DB session.
+
+      harvester [--gather-workers={workers}] [--workers={workers}] [--drain-timeout={seconds}] worker
+        - runs the gather and the fetch consumers in threads of one process,
+          with --gather-workers gather and --workers fetch consumers.
+
+          On SIGTERM the consumers stop taking new messages and the process
+          exits once the messages being processed are done, or after
+          --drain-timeout seconds. On SIGHUP the ckanext.sfa.* settings are
+          read again from the config file.
+
       harvester purge_queues
         - removes all jobs from fetch and gather queue
 
-      harvester [-j] [--segments={segments}] import [{source-id}]
+      harvester [-j] [--segments={segments}] [--parallel={processes}] import [{source-id}]
         - perform the import stage with the last fetched objects, optionally belonging to a certain source.
           Please note that no objects will be fetched from the remote server. It will only affect
           the last fetched objects already present in the database.
@@ -54,12 +131,27 @@ class Harvester(CkanCommand):
           The --segments flag allows to define a string containing hex digits that represent which of
           the 16 harvest object segments to import. e.g. 15af will run segments 1,5,a,f
 
+          The --parallel flag splits the segments across the given number of worker
+          processes, each with its own DB connection, and prints a combined summary.
+
       harvester job-all
         - create new harvest jobs for all active sources.
 
+      harvester [--json] diff {source-id}
+        - compares the current SFA workbook and S3 listing with the datasets
+          harvested last from the source and lists the added, changed and removed
+          datasets. Nothing is written and no job is created. Exits with status 1
+          if there are changes, like diff does, so a harvest can be skipped
+          when there is nothing to do.
+
       harvester reindex
         - reindexes the harvest source datasets
 
+    The run, import, gather_consumer and fetch_consumer commands accept a
+    --profile flag. The work is then profiled with cProfile, the stats are
+    written to --profile-dir (per run or every --profile-every messages of a
+    consumer) and the top --profile-top hotspots are printed on exit.
+
     The commands should be run from the ckanext-harvest directory and expect
     a development.ini file to be present. Most of the time you will
     specify the config explicitly though::
@@ -85,6 +177,28 @@ class Harvester(CkanCommand):
 '''A string containing hex digits that represent which of
  the 16 harvest object segments to import. e.g. 15af will run segments 1,5,a,f''')
 
+        self.parser.add_option('--json', dest='json', action='store_true',
+            default=False, help='Print the result of diff as JSON')
+
+        self.parser.add_option('--parallel', dest='parallel', type='int',
+            default=1, help='Number of processes the import segments are split across')
+
+        self.parser.add_option('--workers', dest='workers', type='int',
+            default=1, help='Number of concurrent consumers to run')
+        self.parser.add_option('--gather-workers', dest='gather_workers', type='int',
+            default=1, help='Number of gather consumers the worker runs')
+        self.parser.add_option('--drain-timeout', dest='drain_timeout', type='int',
+            default=300, help='Seconds the worker waits for messages in progress on SIGTERM')
+
+        self.parser.add_option('--profile', dest='profile',
+            action='store_true', default=False, help='Profile the command with cProfile')
+        self.parser.add_option('--profile-dir', dest='profile_dir',
+            default='.', help='Directory the profile stats are written to')
+        self.parser.add_option('--profile-every', dest='profile_every', type='int',
+            default=1, help='Write the profile stats of consumers every N messages')
+        self.parser.add_option('--profile-top', dest='profile_top', type='int',
+            default=20, help='Number of hotspots printed on exit')
+
     def command(self):
         self._load_config()
 
@@ -100,6 +214,26 @@ class Harvester(CkanCommand):
             self.parser.print_usage()
             sys.exit(1)
         cmd = self.args[0]
+
+        self.stopping = threading.Event()
+        self.busy = set()
+        self.busy_lock = threading.Lock()
+
+        self.profiler = None
+        if self.options.profile:
+            from ckanext.sfa.commands.profiling import CommandProfiler
+            self.profiler = CommandProfiler(self.options.profile_dir,
+                self.options.profile_every, self.options.profile_top)
+            # Make sure the summary is also printed when being stopped
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        try:
+            self.run_command(cmd)
+        finally:
+            if self.profiler:
+                self.profiler.print_summary()
+
+    def run_command(self, cmd):
         if cmd == 'source':
             self.create_harvest_source()
         elif cmd == "rmsource":
@@ -111,21 +245,19 @@ class Harvester(CkanCommand):
         elif cmd == 'jobs':
             self.list_harvest_jobs()
         elif cmd == 'run':
-            self.run_harvester()
+            self.profiled('run', self.run_harvester)
         elif cmd == 'gather_consumer':
-            import logging
             from ckanext.harvest.queue import get_gather_consumer, gather_callback
             logging.getLogger('amqplib').setLevel(logging.INFO)
-            consumer = get_gather_consumer()
-            for method, header, body in consumer.consume(queue='ckan.harvest.gather'):
-                gather_callback(consumer, method, header, body)
+            self.run_consumers(get_gather_consumer, gather_callback,
+                'ckan.harvest.gather', self.options.workers)
         elif cmd == 'fetch_consumer':
-            import logging
             logging.getLogger('amqplib').setLevel(logging.INFO)
             from ckanext.harvest.queue import get_fetch_consumer, fetch_callback
-            consumer = get_fetch_consumer()
-            for method, header, body in consumer.consume(queue='ckan.harvest.fetch'):
-               fetch_callback(consumer, method, header, body)
+            self.run_consumers(get_fetch_consumer, fetch_callback,
+                'ckan.harvest.fetch', self.options.workers)
+        elif cmd == 'worker':
+            self.run_worker()
         elif cmd == 'purge_queues':
             from ckanext.harvest.queue import purge_queues
             purge_queues()
@@ -133,9 +265,11 @@ class Harvester(CkanCommand):
             self.initdb()
         elif cmd == 'import':
             self.initdb()
-            self.import_stage()
+            self.profiled('import', self.import_stage)
         elif cmd == 'job-all':
             self.create_harvest_job_all()
+        elif cmd == 'diff':
+            self.diff()
         elif cmd == 'harvesters-info':
             harvesters_info = get_action('harvesters_info_show')()
             pprint(harvesters_info)
@@ -273,6 +407,10 @@ class Harvester(CkanCommand):
         else:
             source_id = None
 
+        if self.options.parallel > 1:
+            self.import_stage_parallel(source_id)
+            return
+
         context = {'model': model, 'session':model.Session, 'user': self.admin_user['name'],
                    'join_datasets': not self.options.no_join_datasets,
                    'segments': self.options.segments}
@@ -282,6 +420,217 @@ class Harvester(CkanCommand):
 
         print '%s objects reimported' % len(objs)
 
+    def import_stage_parallel(self, source_id):
+        '''
+        Import the segments in several processes, every segment is a task
+        of its own, so progress is reported as each segment finishes
+        '''
+        segments = self.options.segments or SEGMENTS
+        processes = min(self.options.parallel, len(segments))
+        tasks = [(source_id, segment, not self.options.no_join_datasets,
+                  self.admin_user['name']) for segment in segments]
+
+        # The worker processes must not share the connections of this one
+        model.Session.remove()
+        model.meta.engine.dispose()
+
+        print 'Importing segments %s in %d processes' % (segments, processes)
+        pool = multiprocessing.Pool(processes, initializer=_init_import_worker)
+        results = []
+        try:
+            for result in pool.imap_unordered(_import_segment, tasks):
+                results.append(result)
+                if result['error']:
+                    print 'Segment %s failed after %d objects in %.1fs: %s (%d/%d)' % (
+                        result['segment'], result['count'], result['seconds'],
+                        result['error'], len(results), len(tasks))
+                else:
+                    print 'Segment %s: %d objects reimported in %.1fs (%d/%d)' % (
+                        result['segment'], result['count'], result['seconds'],
+                        len(results), len(tasks))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        failed = [result for result in results if result['error']]
+        print ''
+        print '%s objects reimported from %d segments in %d processes' % (
+            sum(result['count'] for result in results), len(segments), processes)
+        if failed:
+            print 'Failed segments: %s' % ''.join(
+                sorted(result['segment'] for result in failed))
+            sys.exit(1)
+
+    def profiled(self, name, func):
+        if self.profiler:
+            return self.profiler.run(name, func)
+        return func()
+
+    def run_consumers(self, get_consumer, callback, queue, workers):
+        '''
+        Run the given number of consumers for a queue, more than one
+        consumer are run in threads of this process
+        '''
+        if self.profiler:
+            callback = self.profiler.wrap(queue, callback)
+
+        if workers <= 1:
+            self.consume(get_consumer, callback, queue)
+            return
+
+        threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.consume,
+                args=(get_consumer, callback, queue),
+                name='%s-%d' % (queue, i))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        log.info('Started %d consumers for %s' % (workers, queue))
+
+        # Join with a timeout so the main thread still gets KeyboardInterrupt
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+
+    def consume(self, get_consumer, callback, queue):
+        '''
+        Consume the messages of a queue one by one
+
+        Every consumer has its own queue connection and only gets one
+        unacknowledged message at a time. The callback acknowledges the
+        message once it is processed. If it raises, the message is
+        requeued once and rejected when it fails again. Once the worker
+        is stopping, a message received is requeued unprocessed.
+        '''
+        consumer = get_consumer()
+        if hasattr(consumer, 'basic_qos'):
+            consumer.basic_qos(prefetch_count=1)
+
+        thread = threading.current_thread()
+        for method, header, body in consumer.consume(queue=queue):
+            if self.stopping.is_set():
+                if hasattr(consumer, 'basic_reject'):
+                    consumer.basic_reject(method.delivery_tag, requeue=True)
+                break
+
+            with self.busy_lock:
+                self.busy.add(thread)
+            try:
+                callback(consumer, method, header, body)
+            except Exception:
+                log.exception('Error processing message %s from %s' % (body, queue))
+                model.Session.rollback()
+                if hasattr(consumer, 'basic_reject'):
+                    requeue = not getattr(method, 'redelivered', True)
+                    consumer.basic_reject(method.delivery_tag, requeue=requeue)
+            finally:
+                # Every thread has its own scoped session
+                model.Session.remove()
+                with self.busy_lock:
+                    self.busy.discard(thread)
+
+            if self.stopping.is_set():
+                break
+
+    def run_worker(self):
+        '''
+        Run the gather and the fetch consumers in threads of this process
+        until SIGTERM, SIGHUP reloads the ckanext.sfa.* settings
+        '''
+        from ckanext.harvest.queue import get_gather_consumer, gather_callback
+        from ckanext.harvest.queue import get_fetch_consumer, fetch_callback
+        logging.getLogger('amqplib').setLevel(logging.INFO)
+
+        consumers = [
+            (get_gather_consumer, gather_callback, 'ckan.harvest.gather',
+             self.options.gather_workers),
+            (get_fetch_consumer, fetch_callback, 'ckan.harvest.fetch',
+             self.options.workers),
+        ]
+        threads = []
+        for get_consumer, callback, queue, workers in consumers:
+            if self.profiler:
+                callback = self.profiler.wrap(queue, callback)
+            for i in range(workers):
+                thread = threading.Thread(target=self.consume,
+                    args=(get_consumer, callback, queue),
+                    name='%s-%d' % (queue, i))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            log.info('Started %d consumers for %s' % (workers, queue))
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_settings())
+
+        try:
+            while not self.stopping.is_set() and any(t.is_alive() for t in threads):
+                self.stopping.wait(1)
+        except KeyboardInterrupt:
+            self.stopping.set()
+
+        # Consumers waiting for a message are idle and left to exit with
+        # the process, only the messages in progress are waited for
+        log.info('Stopping, waiting for %d messages in progress' % len(self.busy))
+        deadline = time.time() + self.options.drain_timeout
+        while self.busy and time.time() < deadline:
+            time.sleep(0.5)
+        if self.busy:
+            log.warning('Stopped with %d messages still in progress' % len(self.busy))
+
+        from ckanext.sfa.harvesters import SFAHarvester
+        SFAHarvester.shutdown_stats()
+
+    def reload_settings(self):
+        '''
+        Read the ckanext.sfa.* settings from the config file again
+        '''
+        from paste.deploy import appconfig
+        from pylons import config
+        from ckanext.sfa.harvesters import SFAHarvester
+
+        try:
+            conf = appconfig('config:' + self.filename)
+        except Exception, e:
+            log.exception('Could not reload the settings: %s' % e)
+            return
+
+        settings = dict((key, value) for key, value in conf.items()
+            if key.startswith('ckanext.sfa.'))
+        for key in [key for key in config if key.startswith('ckanext.sfa.')]:
+            if key not in settings:
+                del config[key]
+        config.update(settings)
+        SFAHarvester.settings_reloaded()
+        log.info('Reloaded the settings %s' % ', '.join(sorted(settings)))
+
+    def diff(self):
+        if len(self.args) >= 2:
+            source_id = unicode(self.args[1])
+        else:
+            print 'Please provide a source id'
+            sys.exit(1)
+
+        from ckanext.sfa.harvesters import SFAHarvester
+        result = SFAHarvester().diff(source_id)
+
+        if self.options.json:
+            print json.dumps(result, indent=2)
+        else:
+            for what in ('added', 'changed', 'removed', 'errors'):
+                print '%s: %d' % (what.capitalize(), len(result[what]))
+                for dataset in result[what]:
+                    print '    %s %s' % (dataset.get('id', dataset['guid']),
+                        dataset.get('error', dataset.get('title', '')))
+            print 'Unchanged: %d' % result['unchanged']
+
+        if result['added'] or result['changed'] or result['removed']:
+            sys.exit(1)
+
     def create_harvest_job_all(self):
         context = {'model': model, 'user': self.admin_user['name'], 'session':model.Session}
         jobs = get_action('harvest_job_create_all')(context,{})
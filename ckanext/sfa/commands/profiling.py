@@ -0,0 +1,120 @@
+import os
+import time
+import pstats
+import cProfile
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class _ThreadState(object):
+    '''
+    The profiler of one consumer thread and its number of calls
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.count = 0
+
+    def reset(self):
+        '''
+        Start a new profiler and return the previous one
+        '''
+        profiler = self.profiler
+        self.profiler = cProfile.Profile()
+        self.count = 0
+        return profiler
+
+
+class CommandProfiler(object):
+    '''
+    Profiles harvester commands with cProfile
+
+    The stats are written as .prof files to the given directory, for
+    consumers every given number of messages per thread. A summary of
+    the top hotspots of all profiled work can be printed at the end.
+    '''
+
+    def __init__(self, directory, every=1, top=20):
+        self.directory = directory
+        self.every = max(every, 1)
+        self.top = top
+        self.stats = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._states = []
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def run(self, name, func, *args, **kwargs):
+        '''
+        Profile a single call and write its stats
+        '''
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            self._dump(name, profiler)
+
+    def wrap(self, name, callback):
+        '''
+        Return the callback profiled, the stats are written
+        every self.every calls of a thread
+        '''
+        def profiled(*args, **kwargs):
+            state = getattr(self._local, 'state', None)
+            if state is None:
+                state = self._local.state = _ThreadState(name)
+                with self._lock:
+                    self._states.append(state)
+
+            state.profiler.enable()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                state.profiler.disable()
+                state.count += 1
+                if state.count >= self.every:
+                    self._dump(name, state.reset())
+        return profiled
+
+    def flush(self):
+        '''
+        Write the stats of calls not written yet
+        '''
+        with self._lock:
+            states = list(self._states)
+        for state in states:
+            if state.count:
+                self._dump(state.name, state.reset())
+
+    def _dump(self, name, profiler):
+        path = os.path.join(self.directory, '%s-%s-%d.prof' % (
+            name,
+            threading.current_thread().name,
+            time.time() * 1000
+        ))
+        profiler.dump_stats(path)
+        log.info('Wrote profile to %s' % path)
+
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(path)
+            else:
+                self.stats.add(path)
+
+    def print_summary(self):
+        '''
+        Print the top hotspots of everything profiled
+        '''
+        self.flush()
+        if self.stats is None:
+            print 'Nothing was profiled'
+            return
+        print 'Top %d hotspots by cumulative time:' % self.top
+        self.stats.sort_stats('cumulative').print_stats(self.top)
+        print 'Top %d hotspots by own time:' % self.top
+        self.stats.sort_stats('time').print_stats(self.top)
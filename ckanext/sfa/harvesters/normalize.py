@@ -0,0 +1,81 @@
+#coding: utf-8
+
+import re
+import threading
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+TAG_SEPARATOR = re.compile(r'\s*[,;]\s*')
+
+
+def split_tags(value):
+    '''
+    Split the tags cell of a row into its tags, the tags can be
+    separated by commas or semicolons with any whitespace around
+    '''
+    return [tag for tag in TAG_SEPARATOR.split(value.strip()) if tag]
+
+
+def name_candidates(name, package_id, suffix_length=5):
+    '''
+    Yield the names a package can get, the name itself and then the
+    name with a growing beginning of the package id, so a package gets
+    the same name on every import
+    '''
+    yield name
+    for length in range(suffix_length, len(package_id) + 1):
+        yield name + '-' + package_id[:length]
+
+
+class LRUCache(object):
+    '''
+    A bounded cache of computed values, the least recently used
+    value is dropped when it is full
+
+    The cache is safe to share between threads. A value missing
+    from the cache is computed outside of the lock, two threads
+    may compute the same value at the same time.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        '''
+        Return the cached value of a key, computing
+        it with compute(key) if it is not cached
+        '''
+        with self._lock:
+            if key in self._values:
+                value = self._values.pop(key)
+                self._values[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = compute(key)
+        with self._lock:
+            self._values[key] = value
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._values),
+            'maxsize': self.maxsize
+        }
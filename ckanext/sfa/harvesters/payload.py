@@ -0,0 +1,109 @@
+#coding: utf-8
+
+import json
+import zlib
+import base64
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SFAPayload(object):
+    '''
+    The content of an SFA harvest object
+
+    Version 1 is the plain JSON of the metadata dict. Version 2 starts
+    with a version prefix, the resources and the translations are stored
+    as compressed sections and the translations as (lang_code, term,
+    term_translation) lists instead of dicts. The sections are only
+    decompressed when they are accessed.
+    '''
+
+    VERSION = 2
+    PREFIX = u'sfa:%d:' % VERSION
+
+    TRANSLATION_KEYS = ('lang_code', 'term', 'term_translation')
+
+    def __init__(self, content):
+        if content.startswith(self.PREFIX):
+            self.version = self.VERSION
+            self._data = json.loads(content[len(self.PREFIX):])
+        else:
+            self.version = 1
+            self._data = json.loads(content)
+        self._sections = {}
+
+    @classmethod
+    def encode(cls, metadata):
+        '''
+        Return the version 2 content for a metadata dict
+        '''
+        data = dict(metadata)
+        if 'resources' in data:
+            data['resources'] = cls._compress(data['resources'])
+        if 'translations' in data:
+            data['translations'] = cls._compress([
+                [translation[key] for key in cls.TRANSLATION_KEYS]
+                for translation in data['translations']
+            ])
+        return cls.PREFIX + json.dumps(data, separators=(',', ':'))
+
+    @classmethod
+    def _compress(cls, value):
+        return base64.b64encode(
+            zlib.compress(json.dumps(value, separators=(',', ':')))
+        )
+
+    @classmethod
+    def _decompress(cls, value):
+        return json.loads(zlib.decompress(base64.b64decode(value)))
+
+    def _section(self, key):
+        if key not in self._sections:
+            value = self._decompress(self._data[key])
+            if key == 'translations':
+                value = [
+                    dict(zip(self.TRANSLATION_KEYS, translation))
+                    for translation in value
+                ]
+            self._sections[key] = value
+        return self._sections[key]
+
+    def __getitem__(self, key):
+        if self.version >= 2 and key in ('resources', 'translations') \
+                and key in self._data:
+            return self._section(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._sections[key] = value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key in self._data:
+            return self[key]
+        return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._data.pop(key, None)
+        self._sections.pop(key, None)
+        return value
+
+    def keys(self):
+        return self._data.keys()
+
+    def to_dict(self):
+        '''
+        Return the full metadata dict, decompressing all sections
+        '''
+        return dict((key, self[key]) for key in self.keys())
+
+    def encode_content(self):
+        '''
+        Return the version 2 content of this payload
+        '''
+        return self.encode(self.to_dict())
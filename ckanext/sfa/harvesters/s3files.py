@@ -0,0 +1,118 @@
+#coding: utf-8
+
+import os
+import tempfile
+import mimetypes
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def download_if_changed(key, file_path):
+    '''
+    Download an S3 key to file_path, unless the file there is current
+
+    The ETag of the downloaded file is kept in file_path + '.etag' and
+    sent with the next download, S3 answers with 304 Not Modified if the
+    key did not change since. Returns the ETag of the file and the number
+    of bytes downloaded, None if the file was unchanged.
+    '''
+    from boto.exception import S3ResponseError
+
+    etag_path = file_path + '.etag'
+    headers = {}
+    if os.path.exists(file_path) and os.path.exists(etag_path):
+        with open(etag_path) as etag_file:
+            headers['If-None-Match'] = etag_file.read().strip()
+
+    # Every download gets its own file, several gathers
+    # may download the same key at the same time
+    fd, download_path = tempfile.mkstemp(
+        suffix='.download',
+        dir=os.path.dirname(file_path)
+    )
+    os.close(fd)
+    try:
+        log.debug('Saving %s to %s' % (key.name, download_path))
+        key.get_contents_to_filename(download_path, headers=headers)
+    except S3ResponseError, e:
+        # boto removes the file itself if the download fails
+        if os.path.exists(download_path):
+            os.remove(download_path)
+        if e.status != 304:
+            raise
+        log.debug('%s unchanged, using %s' % (key.name, file_path))
+        return headers['If-None-Match'], None
+    except Exception:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+        raise
+
+    size = os.path.getsize(download_path)
+    os.rename(download_path, file_path)
+    _write_etag(etag_path, key.etag or '')
+    return key.etag, size
+
+
+def _write_etag(etag_path, etag):
+    fd, tmp_path = tempfile.mkstemp(
+        suffix='.etag',
+        dir=os.path.dirname(etag_path)
+    )
+    with os.fdopen(fd, 'w') as etag_file:
+        etag_file.write(etag)
+    os.rename(tmp_path, etag_path)
+
+
+def list_files_by_dataset(bucket, base):
+    '''
+    List the files below base in one paginated sweep and group them by
+    dataset id, the first path segment after base
+
+    Returns the files keyed by dataset id and the number of files
+    listed. Files directly in base are skipped.
+    '''
+    index = {}
+    file_count = 0
+    for file in bucket.list(prefix=base):
+        file_count += 1
+        path = file.key[len(base):]
+        if u'/' not in path:
+            continue
+        dataset_id = path.split(u'/', 1)[0]
+        index.setdefault(dataset_id, []).append(file)
+    return index, file_count
+
+
+def guess_format(file_name):
+    '''
+    Return the format for a given full filename
+    '''
+    _, file_extension = os.path.splitext(file_name.lower())
+    return file_extension[1:]
+
+
+def resource_dicts(files, prefix, base_url):
+    '''
+    Return the resource dicts of the listed files of a dataset, with
+    size, checksum, last modification and content type
+    '''
+    from boto.utils import parse_ts
+
+    resources = []
+    for file in files:
+        log.debug(file.key)
+        resource = {
+            'url': base_url + '/' + file.key,
+            'name': file.key.replace(prefix, u''),
+            'format': guess_format(file.key),
+            'size': file.size,
+            'hash': (file.etag or u'').strip('"'),
+            'mimetype': mimetypes.guess_type(file.key)[0]
+        }
+        if file.last_modified:
+            resource['last_modified'] = parse_ts(
+                file.last_modified
+            ).isoformat()
+        resources.append(resource)
+    return resources
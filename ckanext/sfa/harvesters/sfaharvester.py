@@ -1,21 +1,34 @@
 #coding: utf-8
 
-import xlrd
 import os
-from boto.s3.connection import S3Connection
-from boto.s3.key import Key
 from uuid import NAMESPACE_OID, uuid4, uuid5
 import tempfile
+import shutil
+import threading
+from functools import partial
+from hashlib import sha1
 
 from ckan import model
 from ckan.model import Session, Package
-from ckan.logic import get_action, action
+from sqlalchemy import and_, bindparam, event, select
+from ckan.logic import get_action, ValidationError
 from ckan.lib.helpers import json
 from ckanext.harvest.harvesters.base import munge_tag
 from ckan.lib.munge import munge_title_to_name
 
-from ckanext.harvest.model import HarvestObject
+from ckanext.harvest.model import HarvestJob, HarvestObject
+from ckanext.harvest.model import HarvestObjectExtra
 from ckanext.harvest.harvesters import HarvesterBase
+from ckanext.sfa.harvesters.workbook import SFAWorkbook
+from ckanext.sfa.harvesters.sourcecache import SFASourceCache
+from ckanext.sfa.harvesters.payload import SFAPayload
+from ckanext.sfa.harvesters.normalize import LRUCache, split_tags
+from ckanext.sfa.harvesters.normalize import name_candidates
+from ckanext.sfa.harvesters.s3files import download_if_changed
+from ckanext.sfa.harvesters.s3files import list_files_by_dataset
+from ckanext.sfa.harvesters.s3files import resource_dicts
+from ckanext.sfa.harvesters.stats import SFAHarvestStats, NullStats
+from ckanext.sfa.harvesters.stats import SFAJobStatsRegistry
 
 from pylons import config
 
@@ -28,14 +41,8 @@ class SFAHarvester(HarvesterBase):
     The harvester for the SFA
     '''
 
-    BUCKET_NAME = config.get('ckanext.sfa.s3_bucket')
     METADATA_FILE_NAME = u'OGD@Bund Metadaten BAR.xlsx'
     DEPARTMENT_BASE = u'ch.bar.'
-    FILES_BASE_URL = 'http://' + BUCKET_NAME + '.s3.amazonaws.com'
-
-    # Define the keys in the CKAN .ini file
-    AWS_ACCESS_KEY = config.get('ckanext.sfa.s3_key')
-    AWS_SECRET_KEY = config.get('ckanext.sfa.s3_token')
 
     ORGANIZATION = {
         'de': {
@@ -70,101 +77,343 @@ class SFAHarvester(HarvesterBase):
     }
     LANG_CODES = ['de', 'fr', 'it', 'en']
 
+    # The S3 settings are read from the CKAN .ini file on use, so the
+    # harvester can be loaded by processes which never harvest
+    @property
+    def BUCKET_NAME(self):
+        bucket_name = config.get('ckanext.sfa.s3_bucket')
+        if not bucket_name:
+            raise ValueError('ckanext.sfa.s3_bucket is not configured')
+        return bucket_name
+
+    @property
+    def FILES_BASE_URL(self):
+        return 'http://' + self.BUCKET_NAME + '.s3.amazonaws.com'
+
+    @property
+    def AWS_ACCESS_KEY(self):
+        return config.get('ckanext.sfa.s3_key')
+
+    @property
+    def AWS_SECRET_KEY(self):
+        return config.get('ckanext.sfa.s3_token')
+
+    # Key of the harvest object extra holding the content fingerprint
+    FINGERPRINT_KEY = 'sfa_fingerprint'
+
     config = {
         'user': u'harvest'
     }
 
+    # State shared by all harvester instances of the process,
+    # kept per thread as boto connections are not thread safe
+    _local = threading.local()
+
+    _db_listener_registered = False
+
+    # Normalised tags and names, shared by all harvester instances
+    # and threads of the process
+    NORMALIZE_CACHE_SIZE = 20000
+    _tag_cache = LRUCache(NORMALIZE_CACHE_SIZE)
+    _name_cache = LRUCache(NORMALIZE_CACHE_SIZE)
+
+    # Incremented when the ckanext.sfa settings are reloaded
+    _settings_version = 0
+
+    @classmethod
+    def settings_reloaded(cls):
+        '''
+        Drop the S3 connections of all threads after the settings changed,
+        every thread connects again on its next use of the bucket
+        '''
+        cls._settings_version += 1
+
+    def _normalize_tag(self, tag):
+        '''
+        Return the munged tag, memoised
+        '''
+        return self._tag_cache.get(tag, munge_tag)
+
+    def _normalize_name(self, title):
+        '''
+        Return the URL friendly name of a title, memoised
+        '''
+        return self._name_cache.get(title, munge_title_to_name)
+
+    def _start_stats(self, stats):
+        '''
+        Make the given stats the active ones of the current thread,
+        DB queries of the thread are counted in them
+        '''
+        if not SFAHarvester._db_listener_registered:
+            SFAHarvester._db_listener_registered = True
+            event.listen(
+                model.meta.engine,
+                'before_cursor_execute',
+                self._count_db_query
+            )
+        self._local.stats = stats
+        return stats
+
+    def _count_db_query(self, *args, **kwargs):
+        stats = getattr(SFAHarvester._local, 'stats', None)
+        if stats is not None:
+            stats.incr('db_queries')
+
+    # Stats of the fetch and import stages of the jobs in progress,
+    # shared by all threads of the process
+    _job_stats = SFAJobStatsRegistry()
+
+    def _count_job_objects(self, job_id):
+        return Session.query(HarvestObject.id) \
+            .filter(HarvestObject.harvest_job_id == job_id).count()
+
+    def _get_job_stats(self, job_id, stage):
+        '''
+        Return the stats of a stage of a job, they are emitted
+        once the last harvest object of the job is processed
+        '''
+        return self._job_stats.get(job_id, self._count_job_objects) \
+            .stages[stage]
+
+    def _object_done(self, job_id):
+        '''
+        Count a processed harvest object and emit the stats of
+        its job after the last one
+        '''
+        self._job_stats.object_done(job_id, self._count_job_objects)
+
+    @classmethod
+    def flush_job_stats(cls, idle=None):
+        '''
+        Emit the stats of all jobs in progress, see
+        SFAJobStatsRegistry.flush
+        '''
+        cls._job_stats.flush(idle)
+
+    @classmethod
+    def shutdown_stats(cls):
+        '''
+        Emit the stats of all jobs in progress and remove the
+        textfiles of the process, called when it exits
+        '''
+        cls._job_stats.shutdown()
+
+    def _stats(self):
+        '''
+        Return the stats of the current thread
+        '''
+        stats = getattr(self._local, 'stats', None)
+        if stats is None:
+            stats = self._local.stats = NullStats()
+        return stats
+
     def _get_s3_bucket(self):
         '''
-        Create an S3 connection to the department bucket
+        Return the department bucket, the S3 connection is
+        only created once per thread and then reused
         '''
-        conn = S3Connection(self.AWS_ACCESS_KEY, self.AWS_SECRET_KEY)
-        bucket = conn.get_bucket(self.BUCKET_NAME)
+        bucket = getattr(self._local, 's3_bucket', None)
+        version = getattr(self._local, 's3_settings_version', None)
+        if bucket is None or version != self._settings_version:
+            from boto.s3.connection import S3Connection
+            connection = S3Connection(
+                self.AWS_ACCESS_KEY,
+                self.AWS_SECRET_KEY
+            )
+            bucket = connection.get_bucket(self.BUCKET_NAME)
+            self._local.s3_bucket = bucket
+            self._local.s3_settings_version = self._settings_version
         return bucket
 
+    _old_temp_dirs_removed = False
+
+    def _get_cache_dir(self):
+        '''
+        Return the directory the metadata file is cached in,
+        configured with ckanext.sfa.cache_dir in the CKAN .ini file
+        '''
+        cache_dir = config.get(
+            'ckanext.sfa.cache_dir',
+            os.path.join(tempfile.gettempdir(), 'ckanext-sfa')
+        )
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        return cache_dir
+
+    def _remove_old_temp_dirs(self):
+        '''
+        Remove the temporary directories earlier versions of the
+        harvester downloaded the metadata file to and never deleted
+        '''
+        if SFAHarvester._old_temp_dirs_removed:
+            return
+        SFAHarvester._old_temp_dirs_removed = True
+
+        temp_dir = tempfile.gettempdir()
+        for name in os.listdir(temp_dir):
+            path = os.path.join(temp_dir, name)
+            if not name.startswith(tempfile.template):
+                continue
+            try:
+                if os.listdir(path) == [self.METADATA_FILE_NAME]:
+                    log.debug('Removing old temp directory %s' % path)
+                    shutil.rmtree(path)
+            except OSError:
+                continue
+
     def _fetch_metadata_file(self):
         '''
         Fetching the Excel metadata file for the SFA
         from the S3 Bucket and save on disk
+
+        The last file and its ETag are kept in the cache directory,
+        the file is only downloaded again if it changed on S3.
         '''
-        temp_dir = tempfile.mkdtemp()
         try:
-            metadata_file = Key(self._get_s3_bucket())
-            metadata_file.key = self.METADATA_FILE_NAME
+            self._remove_old_temp_dirs()
+
             metadata_file_path = os.path.join(
-                temp_dir,
+                self._get_cache_dir(),
                 self.METADATA_FILE_NAME
             )
-            log.debug('Saving metadata file to %s' % metadata_file_path)
-            metadata_file.get_contents_to_filename(metadata_file_path)
+            metadata_file = self._get_s3_bucket().new_key(
+                self.METADATA_FILE_NAME
+            )
+            self._local.metadata_etag = None
+            self._stats().incr('s3_requests')
+            etag, size = download_if_changed(
+                metadata_file,
+                metadata_file_path
+            )
+            if size is not None:
+                self._stats().incr('bytes_downloaded', size)
+            self._local.metadata_etag = etag
             return metadata_file_path
         except Exception, e:
             log.exception(e)
             raise
 
-    def _guess_format(self, file_name):
+    def _get_metadata_etag(self):
         '''
-        Return the format for a given full filename
+        Return the ETag of the metadata file fetched last by this thread
         '''
-        _, file_extension = os.path.splitext(file_name.lower())
-        return file_extension[1:]
+        return getattr(self._local, 'metadata_etag', None)
 
-    def _generate_resources_dict_array(self, dataset_id):
+    def _get_dataset_prefix(self, dataset_id):
+        return self.DEPARTMENT_BASE + dataset_id + u'/'
+
+    def _build_resources_index(self, workbook=None, skip_ids=None):
         '''
+        Return the files of the department grouped by dataset id and
+        the errors of datasets whose files could not be listed
 
+        With ckanext.sfa.s3_list_workers set to more than one, the
+        prefixes of the datasets in the workbook are listed concurrently,
+        except the ones in skip_ids. Otherwise the whole department is
+        listed in one sweep.
         '''
+        workers = int(config.get('ckanext.sfa.s3_list_workers', 1))
+        if workbook is None or workers <= 1:
+            return self._list_department_files(), {}
+
+        skip_ids = skip_ids or set()
+        dataset_ids = [
+            dataset_id for dataset_id in workbook.dataset_ids()
+            if dataset_id not in skip_ids
+        ]
+
+        from multiprocessing.pool import ThreadPool
+
+        # The pool threads count their requests in the stats of this one
+        list_files = partial(self._list_dataset_files, stats=self._stats())
+        pool = ThreadPool(workers)
         try:
-            resources = []
-            prefix = self.DEPARTMENT_BASE + dataset_id + u'/'
-            bucket_list = self._get_s3_bucket().list(prefix=prefix)
-            for file in bucket_list:
-                log.debug(file.key)
-                resources.append({
-                    'url': self.FILES_BASE_URL + '/' + file.key,
-                    'name': file.key.replace(prefix, u''),
-                    'format': self._guess_format(file.key),
-                    'size': self._get_s3_bucket().lookup(file.key).size
-                })
-            return resources
+            results = pool.map(list_files, dataset_ids)
+        finally:
+            pool.close()
+            pool.join()
+
+        index = {}
+        errors = {}
+        for dataset_id, files, error in results:
+            if error is None:
+                index[dataset_id] = files
+            else:
+                errors[dataset_id] = error
+        log.debug(
+            'Listed the files of %d datasets with %d workers, %d failed'
+            % (len(dataset_ids), workers, len(errors))
+        )
+        return index, errors
+
+    def _list_department_files(self):
+        '''
+        List all files of the department in one paginated sweep
+        and group them by dataset id
+        '''
+        try:
+            index, file_count = list_files_by_dataset(
+                self._get_s3_bucket(),
+                self.DEPARTMENT_BASE
+            )
+            self._count_list_requests(self._stats(), file_count)
+            log.debug(
+                'Found files for %d datasets in the bucket' % len(index)
+            )
+            return index
         except Exception, e:
             log.exception(e)
             raise
 
-    def _get_row_dict_array(self, lang_index, file_path):
+    def _list_dataset_files(self, dataset_id, stats=None):
         '''
+        List the files of one dataset, returns the dataset id,
+        the files and the error message if listing failed
         '''
+        stats = stats or self._stats()
         try:
-            metadata_workbook = xlrd.open_workbook(file_path)
-            worksheet = metadata_workbook.sheet_by_index(lang_index)
-
-            # Extract the row headers
-            header_row = worksheet.row_values(6)
-            rows = []
-            for row_num in range(worksheet.nrows):
-                # Data columns begin at row count 7 (8 in Excel)
-                if row_num >= 7:
-                    rows.append(dict(zip(
-                        header_row,
-                        worksheet.row_values(row_num)
-                    )))
-            return rows
+            with stats.timer('s3_dataset_listing'):
+                files = list(self._get_s3_bucket().list(
+                    prefix=self._get_dataset_prefix(dataset_id)
+                ))
+            self._count_list_requests(stats, len(files))
+            return dataset_id, files, None
+        except Exception, e:
+            log.exception(e)
+            return dataset_id, None, str(e)
 
+    def _count_list_requests(self, stats, file_count):
+        '''
+        Count the requests of a listing, S3 returns
+        up to 1000 keys per request
+        '''
+        stats.incr('s3_requests', max(1, (file_count + 999) // 1000))
+        stats.incr('s3_files_listed', file_count)
+
+    def _generate_resources_dict_array(self, dataset_id, files):
+        '''
+        Return the resource dicts of a dataset from its listed files,
+        with size, checksum, last modification and content type
+        '''
+        try:
+            return resource_dicts(
+                files,
+                self._get_dataset_prefix(dataset_id),
+                self.FILES_BASE_URL
+            )
         except Exception, e:
             log.exception(e)
             raise
 
-    def _generate_term_translations(self, lang_index, file_path):
+    def _generate_term_translations(self, lang_code, de_row, other_row):
         '''
+        Return the term translations of one dataset row
+        for the given language
         '''
         try:
             translations = []
 
-            de_rows = self._get_row_dict_array(0, file_path)
-            other_rows = self._get_row_dict_array(lang_index, file_path)
-
-            log.debug(de_rows)
-            log.debug(other_rows)
-
             keys = [
                 'title',
                 'notes',
@@ -174,40 +423,268 @@ class SFAHarvester(HarvesterBase):
                 'groups'
             ]
 
-            for row_idx in range(len(de_rows)):
-                for key in keys:
+            for key in keys:
+                translations.append({
+                    'lang_code': lang_code,
+                    'term': de_row[key],
+                    'term_translation': other_row[key]
+                })
+
+            de_tags = split_tags(de_row['tags'])
+            other_tags = split_tags(other_row['tags'])
+
+            if len(de_tags) == len(other_tags):
+                for de_tag, other_tag in zip(de_tags, other_tags):
                     translations.append({
-                        'lang_code': self.LANG_CODES[lang_index],
-                        'term': de_rows[row_idx][key],
-                        'term_translation': other_rows[row_idx][key]
+                        'lang_code': lang_code,
+                        'term': self._normalize_tag(de_tag),
+                        'term_translation': self._normalize_tag(other_tag)
                     })
 
-                de_tags = de_rows[row_idx]['tags'].split(u', ')
-                other_tags = other_rows[row_idx]['tags'].split(u', ')
-
-                if len(de_tags) == len(other_tags):
-                    for tag_idx in range(len(de_tags)):
-                        translations.append({
-                            'lang_code': self.LANG_CODES[lang_index],
-                            'term': munge_tag(de_tags[tag_idx]),
-                            'term_translation': munge_tag(other_tags[tag_idx])
-                        })
-
-            for lang, org in self.ORGANIZATION.items():
-                if lang != 'de':
-                    for field in ['name', 'description']:
-                        translations.append({
-                            'lang_code': lang,
-                            'term': self.ORGANIZATION['de'][field],
-                            'term_translation': org[field]
-                        })
-
             return translations
 
         except Exception, e:
             log.exception(e)
             raise
 
+    def _generate_dataset_translations(self, rows):
+        '''
+        Return the term translations of a dataset in all languages
+        from its rows in the language sheets, keyed by language code
+        '''
+        translations = []
+        de_row = rows['de']
+        for lang_code in self.LANG_CODES:
+            if lang_code == 'de':
+                continue
+            other_row = rows[lang_code]
+            if other_row is None:
+                log.warning(
+                    'Dataset %s is missing in the %s sheet'
+                    % (de_row[u'id'], lang_code)
+                )
+                continue
+            translations.extend(
+                self._generate_term_translations(lang_code, de_row, other_row)
+            )
+        return translations
+
+    def _generate_organization_translations(self):
+        '''
+        Return the term translations of the organization
+        '''
+        translations = []
+        for lang, org in self.ORGANIZATION.items():
+            if lang != 'de':
+                for field in ['name', 'description']:
+                    translations.append({
+                        'lang_code': lang,
+                        'term': self.ORGANIZATION['de'][field],
+                        'term_translation': org[field]
+                    })
+        return translations
+
+    def _update_organization_translations(self):
+        '''
+        Add the organization translations to the term_translations table,
+        this only has to be done once per job
+        '''
+        with self._stats().timer('translation_writes'):
+            self._update_term_translations(
+                self._generate_organization_translations()
+            )
+            Session.commit()
+
+    def _update_term_translations(self, translations):
+        '''
+        Write the given translations to the term_translation table
+
+        Duplicate (term, lang_code) pairs are dropped and the translations
+        are diffed against the existing rows, so only new or changed
+        translations are written. Returns the number of inserted, updated
+        and unchanged translations.
+        '''
+        table = model.term_translation_table
+
+        # The last translation of a term wins, like with
+        # consecutive term_translation_update calls
+        translations_by_term = {}
+        for translation in translations:
+            if not translation['term'] or \
+                    not translation['term_translation']:
+                continue
+            key = (translation['term'], translation['lang_code'])
+            translations_by_term[key] = translation['term_translation']
+
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if not translations_by_term:
+            return counts
+
+        conn = Session.connection()
+        terms = set(term for term, lang_code in translations_by_term)
+        existing = {}
+        query = select([
+            table.c.term,
+            table.c.lang_code,
+            table.c.term_translation
+        ]).where(table.c.term.in_(terms))
+        for row in conn.execute(query):
+            existing[(row.term, row.lang_code)] = row.term_translation
+
+        new_rows = []
+        changed_keys = []
+        for key, term_translation in translations_by_term.items():
+            if key not in existing:
+                counts['inserted'] += 1
+            elif existing[key] != term_translation:
+                counts['updated'] += 1
+                changed_keys.append({'b_term': key[0], 'b_lang_code': key[1]})
+            else:
+                counts['unchanged'] += 1
+                continue
+            new_rows.append({
+                'term': key[0],
+                'lang_code': key[1],
+                'term_translation': term_translation
+            })
+
+        if changed_keys:
+            conn.execute(
+                table.delete().where(and_(
+                    table.c.term == bindparam('b_term'),
+                    table.c.lang_code == bindparam('b_lang_code')
+                )),
+                changed_keys
+            )
+        if new_rows:
+            conn.execute(table.insert(), new_rows)
+
+        log.info(
+            'Term translations: %(inserted)d inserted, %(updated)d updated, '
+            '%(unchanged)d unchanged' % counts
+        )
+        return counts
+
+    def _compute_fingerprint(self, rows, resources_index):
+        '''
+        Return a hash over the rows of a dataset in all language sheets
+        and the keys, sizes and ETags of its files on S3
+        '''
+        content = {
+            'rows': rows,
+            'files': sorted(
+                [file.key, file.size, file.etag]
+                for file in resources_index.get(rows['de'][u'id'], [])
+            )
+        }
+        return sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+    def _get_current_objects(self, source_id):
+        '''
+        Return the guid, package id, package state and fingerprint of the
+        current harvest objects of a source keyed by guid, using a single
+        query
+        '''
+        query = Session.query(
+            HarvestObject.guid,
+            HarvestObject.package_id,
+            Package.state,
+            HarvestObjectExtra.value
+        ) \
+            .join(HarvestJob, HarvestObject.harvest_job_id == HarvestJob.id) \
+            .outerjoin(Package, Package.id == HarvestObject.package_id) \
+            .outerjoin(HarvestObjectExtra, and_(
+                HarvestObjectExtra.harvest_object_id == HarvestObject.id,
+                HarvestObjectExtra.key == self.FINGERPRINT_KEY
+            )) \
+            .filter(HarvestJob.source_id == source_id) \
+            .filter(HarvestObject.current)
+
+        current = {}
+        for guid, package_id, state, fingerprint in query:
+            current[guid] = {
+                'guid': guid,
+                'package_id': package_id,
+                'state': state,
+                'fingerprint': fingerprint
+            }
+        return current
+
+    def _get_previous_fingerprints(self, source_id, current=None):
+        '''
+        Return the fingerprints of the current harvest objects of a
+        source keyed by guid, only for packages which are still active
+        '''
+        if current is None:
+            current = self._get_current_objects(source_id)
+        return dict(
+            (guid, obj['fingerprint'])
+            for guid, obj in current.items()
+            if obj['fingerprint'] and obj['state'] == 'active'
+        )
+
+    def diff(self, source_id):
+        '''
+        Compare the current workbook and S3 listing with the datasets
+        harvested last from a source, without writing anything to CKAN
+
+        Returns the added, changed and removed datasets, the number of
+        unchanged ones and the datasets whose files could not be listed.
+        '''
+        file_path = self._fetch_metadata_file()
+        workbook = SFAWorkbook(file_path, self.LANG_CODES)
+        resources_index, listing_errors = self._build_resources_index(
+            workbook
+        )
+        current = self._get_current_objects(source_id)
+        previous_fingerprints = self._get_previous_fingerprints(
+            source_id,
+            current
+        )
+
+        result = {
+            'added': [],
+            'changed': [],
+            'removed': [],
+            'unchanged': 0,
+            'errors': []
+        }
+        seen = set()
+        for rows in workbook.iter_datasets():
+            row = rows['de']
+            guid = self._create_uuid(row[u'id'])
+            seen.add(guid)
+            dataset = {'id': row[u'id'], 'guid': guid, 'title': row[u'title']}
+
+            if row[u'id'] in listing_errors:
+                dataset['error'] = listing_errors[row[u'id']]
+                result['errors'].append(dataset)
+            elif guid not in current:
+                result['added'].append(dataset)
+            elif previous_fingerprints.get(guid) != self._compute_fingerprint(
+                    rows, resources_index):
+                dataset['package_id'] = current[guid]['package_id']
+                result['changed'].append(dataset)
+            else:
+                result['unchanged'] += 1
+
+        # Same rules as gather for the datasets to withdraw
+        for guid in self._get_removed_guids(current, seen):
+            result['removed'].append({
+                'guid': guid,
+                'package_id': current[guid]['package_id']
+            })
+        return result
+
+    def _get_object_extra(self, harvest_object, key):
+        '''
+        Return the value of a harvest object extra or None
+        '''
+        for extra in harvest_object.extras:
+            if extra.key == key:
+                return extra.value
+        return None
+
     def _create_uuid(self, name=None):
         '''
         Create a new SHA-1 uuid for a given name or a random id
@@ -219,22 +696,292 @@ class SFAHarvester(HarvesterBase):
 
         return unicode(new_uuid)
 
-    def _gen_new_name(self, title, current_id=None):
+    def _gen_new_name(self, title, current_id, source_cache):
         '''
         Creates a URL friendly name from a title
 
-        If the name already exists, it will add
-        some random characters at the end
+        If the name already exists, it will add the beginning of the
+        dataset id at the end, so the name is the same on every import.
+        Names missing from the name index of the source cache are taken
+        as free, if another consumer took one meanwhile saving the
+        package fails and _save_package picks the next name. Names the
+        index maps to another package are checked in the database, as
+        that package may have been renamed since the index was loaded.
         '''
 
-        name = munge_title_to_name(title).replace('_', '-')
+        name = self._normalize_name(title).replace('_', '-')
         while '--' in name:
             name = name.replace('--', '-')
-        pkg_obj = Session.query(Package).filter(Package.name == name).first()
-        if pkg_obj and pkg_obj.id != current_id:
-            return name + str(uuid4())[:5]
-        else:
-            return name
+
+        source_cache.ensure_names(
+            lambda: Session.query(Package.name, Package.id).all()
+        )
+
+        for new_name in name_candidates(name, current_id):
+            if self._is_name_free(new_name, current_id, source_cache):
+                source_cache.set_name(new_name, current_id)
+                return new_name
+        raise ValueError(
+            'No free name for %s based on %s' % (current_id, name)
+        )
+
+    def _save_package(self, package_dict, harvest_object, source_cache):
+        '''
+        Create or update a package, if saving fails because another
+        consumer took its name meanwhile, it is saved again with a
+        new name
+        '''
+        error = None
+        try:
+            result = self._create_or_update_package(
+                package_dict,
+                harvest_object
+            )
+            if result:
+                return result
+        except ValidationError, e:
+            if 'name' not in e.error_dict:
+                raise
+            Session.rollback()
+            error = e
+
+        row = Session.query(Package.id) \
+            .filter(Package.name == package_dict['name']).first()
+        if row is None or row[0] == package_dict['id']:
+            if error is not None:
+                raise error
+            return result
+
+        log.info(
+            'The name %s was taken by %s, saving %s with a new name'
+            % (package_dict['name'], row[0], package_dict['id'])
+        )
+        source_cache.refresh_name(package_dict['name'], row[0])
+        package_dict['name'] = self._gen_new_name(
+            package_dict[u'title'],
+            package_dict['id'],
+            source_cache
+        )
+        return self._create_or_update_package(package_dict, harvest_object)
+
+    def _is_name_free(self, name, current_id, source_cache):
+        '''
+        Whether a name is unused or used by the given package, a name
+        used by another package is checked in the database
+        '''
+        owner = source_cache.names.get(name)
+        if owner is None or owner == current_id:
+            return True
+
+        row = Session.query(Package.id).filter(Package.name == name).first()
+        source_cache.refresh_name(name, row[0] if row else None)
+        return row is None or row[0] == current_id
+
+    # Lookups of the harvest sources, shared by all threads of the process
+    _source_caches = {}
+    _source_caches_lock = threading.Lock()
+
+    def _get_source_cache(self, source_id):
+        '''
+        Return the cache of the given harvest source, it is kept for all
+        jobs of the source and replaced after ckanext.sfa.cache_max_age
+        seconds (default 3600)
+        '''
+        with SFAHarvester._source_caches_lock:
+            source_cache = SFAHarvester._source_caches.get(source_id)
+            if source_cache is None or source_cache.is_expired():
+                source_cache = SFAHarvester._source_caches[source_id] = \
+                    SFASourceCache(
+                        source_id,
+                        int(config.get('ckanext.sfa.cache_max_age', 3600))
+                    )
+            return source_cache
+
+    def _load_group_index(self, context, action_name):
+        '''
+        Return the ids of all groups or organizations
+        keyed by their id and their name
+        '''
+        index = {}
+        groups = get_action(action_name)(context, {'all_fields': True})
+        for group in groups:
+            index[group['id']] = group['id']
+            index[group['name']] = group['id']
+        return index
+
+    def _resolve_groups(self, context, group_names, source_cache):
+        '''
+        Find or create the given groups, all existing groups
+        are loaded with a single group_list call per source cache
+        '''
+        if source_cache.groups is None:
+            source_cache.groups = self._load_group_index(context, 'group_list')
+            self._stats().incr('logic_calls')
+
+        for group_name in group_names:
+            if group_name in source_cache.groups:
+                log.debug('found the group ' + source_cache.groups[group_name])
+                self._stats().incr('logic_calls_avoided')
+                continue
+
+            data_dict = {
+                'id': group_name,
+                'name': self._normalize_name(group_name),
+                'title': group_name
+            }
+            group = get_action('group_create')(context, data_dict)
+            self._stats().incr('logic_calls')
+            log.info('created the group ' + group['id'])
+            source_cache.groups[group_name] = group['id']
+            source_cache.groups[group['name']] = group['id']
+
+    def _resolve_organization(self, context, source_cache):
+        '''
+        Find or create the SFA organization and return its id,
+        the organizations are loaded once per source cache
+        '''
+        data_dict = {
+            'permission': 'edit_group',
+            'id': self._normalize_name(self.ORGANIZATION['de']['name']),
+            'name': self._normalize_name(self.ORGANIZATION['de']['name']),
+            'title': self.ORGANIZATION['de']['name'],
+            'description': self.ORGANIZATION['de']['description'],
+            'extras': [
+                {
+                    'key': 'website',
+                    'value': self.ORGANIZATION['de']['website']
+                }
+            ]
+        }
+
+        if source_cache.organizations is None:
+            source_cache.organizations = self._load_group_index(
+                context,
+                'organization_list'
+            )
+            self._stats().incr('logic_calls')
+
+        if data_dict['id'] in source_cache.organizations:
+            self._stats().incr('logic_calls_avoided')
+            return source_cache.organizations[data_dict['id']]
+
+        organization = get_action('organization_create')(context, data_dict)
+        self._stats().incr('logic_calls')
+        source_cache.organizations[data_dict['id']] = organization['id']
+        return organization['id']
+
+    def _get_checkpoint_path(self, source_id):
+        return os.path.join(
+            self._get_cache_dir(),
+            'gather-%s.checkpoint' % source_id
+        )
+
+    def _load_checkpoint(self, source_id):
+        '''
+        Return the gather checkpoint of a source, or None
+        '''
+        path = self._get_checkpoint_path(source_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as checkpoint_file:
+                return json.loads(checkpoint_file.read())
+        except (IOError, ValueError), e:
+            log.warning('Ignoring the checkpoint %s: %s' % (path, e))
+            return None
+
+    def _save_checkpoint(self, source_id, checkpoint):
+        '''
+        Write the gather checkpoint of a source, replacing the previous one
+        '''
+        path = self._get_checkpoint_path(source_id)
+        with open(path + '.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write(json.dumps(checkpoint))
+        os.rename(path + '.tmp', path)
+
+    def _remove_checkpoint(self, source_id):
+        path = self._get_checkpoint_path(source_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _resume_gather(self, checkpoint, workbook, harvest_job):
+        '''
+        Move the harvest objects saved by the interrupted job to this one
+        and return their ids and the ids of the datasets already gathered
+
+        Datasets which failed before the interruption are gathered again.
+        '''
+        log.info(
+            'Resuming the gather of job %s after dataset %s'
+            % (checkpoint['job_id'], checkpoint['last_dataset_id'])
+        )
+        if checkpoint['job_id'] != harvest_job.id:
+            Session.query(HarvestObject) \
+                .filter(HarvestObject.harvest_job_id == checkpoint['job_id']) \
+                .update(
+                    {'harvest_job_id': harvest_job.id},
+                    synchronize_session=False
+                )
+            Session.commit()
+        ids = [
+            object_id for object_id, in Session.query(HarvestObject.id)
+            .filter(HarvestObject.harvest_job_id == harvest_job.id)
+        ]
+
+        dataset_ids = workbook.dataset_ids()
+        if checkpoint['last_dataset_id'] not in dataset_ids:
+            return ids, set()
+        last = dataset_ids.index(checkpoint['last_dataset_id'])
+        done_ids = set(dataset_ids[:last + 1])
+        return ids, done_ids - set(checkpoint['failed_ids'])
+
+    def _gather_dataset(self, rows, resources_index, previous_fingerprints):
+        '''
+        Return the guid, content and fingerprint of the harvest object
+        of a dataset, or None if the dataset did not change
+        '''
+        row = rows['de']
+        guid = self._create_uuid(row[u'id'])
+
+        # Skip datasets which did not change
+        # since the last successful harvest
+        fingerprint = self._compute_fingerprint(rows, resources_index)
+        if previous_fingerprints.get(guid) == fingerprint:
+            log.debug('skipping unchanged dataset ' + row[u'id'])
+            self._stats().incr('datasets_unchanged')
+            return None
+
+        # Construct the metadata dict for the dataset on CKAN
+        metadata = {
+            'datasetID': row[u'id'],
+            'title': row[u'title'],
+            'url': row[u'url'],
+            'notes': row[u'notes'],
+            'author': row[u'author'],
+            'maintainer': row[u'maintainer'],
+            'maintainer_email': row[u'maintainer_email'],
+            'license_id': row[u'licence'],
+            'license_url': row[u'licence_url'],
+            'translations': [],
+            'tags': split_tags(row[u'tags']),
+            'groups': [row[u'groups']],
+            # The resources are resolved in the fetch stage
+            'resources_version': row[u'version']
+        }
+
+        # Adding term translations
+        metadata['translations'].extend(
+            self._generate_dataset_translations(rows)
+        )
+
+        log.debug(metadata['translations'])
+
+        log.debug('adding ' + row[u'id'] + ' to the queue')
+        return {
+            'guid': guid,
+            'content': SFAPayload.encode(metadata),
+            'fingerprint': fingerprint
+        }
 
     def info(self):
         return {
@@ -246,77 +993,323 @@ class SFAHarvester(HarvesterBase):
 
     def gather_stage(self, harvest_job):
         log.debug('In SFAHarvester gather_stage')
+        stats = self._start_stats(SFAHarvestStats('gather', harvest_job.id))
+        source_id = harvest_job.source.id
         try:
-            file_path = self._fetch_metadata_file()
+            with stats.timer('fetch_metadata_file'):
+                file_path = self._fetch_metadata_file()
             ids = []
+            batch = []
+            batch_size = int(config.get('ckanext.sfa.gather_batch_size', 100))
 
-            de_rows = self._get_row_dict_array(0, file_path)
-            for row in de_rows:
-                # Construct the metadata dict for the dataset on CKAN
-                metadata = {
-                    'datasetID': row[u'id'],
-                    'title': row[u'title'],
-                    'url': row[u'url'],
-                    'notes': row[u'notes'],
-                    'author': row[u'author'],
-                    'maintainer': row[u'maintainer'],
-                    'maintainer_email': row[u'maintainer_email'],
-                    'license_id': row[u'licence'],
-                    'license_url': row[u'licence_url'],
-                    'translations': [],
-                    'tags': row[u'tags'].split(u', '),
-                    'groups': [row[u'groups']]
-                }
+            workbook = SFAWorkbook(file_path, self.LANG_CODES)
 
-                metadata['resources'] = self._generate_resources_dict_array(
-                    row[u'id']
+            # Resume an interrupted gather of the same metadata file
+            done_ids = set()
+            checkpoint = self._load_checkpoint(source_id)
+            metadata_etag = self._get_metadata_etag()
+            if checkpoint and metadata_etag \
+                    and checkpoint['etag'] == metadata_etag:
+                ids, done_ids = self._resume_gather(
+                    checkpoint,
+                    workbook,
+                    harvest_job
                 )
-                metadata['resources'][0]['version'] = row[u'version']
-                log.debug(metadata['resources'])
+                checkpoint['job_id'] = harvest_job.id
+                self._save_checkpoint(source_id, checkpoint)
+            checkpoint = {
+                'job_id': harvest_job.id,
+                'etag': metadata_etag,
+                'last_dataset_id': None,
+                'failed_ids': []
+            }
 
-                # Adding term translations
-                metadata['translations'].extend(
-                    self._generate_term_translations(1, file_path)  # fr
-                )
-                metadata['translations'].extend(
-                    self._generate_term_translations(2, file_path)  # it
-                )
-                metadata['translations'].extend(
-                    self._generate_term_translations(3, file_path)  # en
-                )
+            self._update_organization_translations()
 
-                log.debug(metadata['translations'])
+            with stats.timer('s3_listing'):
+                resources_index, listing_errors = \
+                    self._build_resources_index(workbook, done_ids)
+            current = self._get_current_objects(source_id)
+            previous_fingerprints = self._get_previous_fingerprints(
+                source_id,
+                current
+            )
 
-                obj = HarvestObject(
-                    guid=self._create_uuid(row[u'id']),
-                    job=harvest_job,
-                    content=json.dumps(metadata)
-                )
-                obj.save()
-                log.debug('adding ' + row[u'id'] + ' to the queue')
-                ids.append(obj.id)
+            datasets = stats.timed_iter(
+                'workbook_parsing',
+                workbook.iter_datasets()
+            )
+            seen = set()
+            for rows in datasets:
+                row = rows['de']
+                stats.incr('datasets')
+                seen.add(self._create_uuid(row[u'id']))
+                if row[u'id'] in done_ids:
+                    stats.incr('datasets_resumed')
+                    continue
+
+                if row[u'id'] in listing_errors:
+                    error = 'Could not list the files of %s: %s' \
+                        % (row[u'id'], listing_errors[row[u'id']])
+                    spec = None
+                else:
+                    try:
+                        error = None
+                        spec = self._gather_dataset(
+                            rows,
+                            resources_index,
+                            previous_fingerprints
+                        )
+                    except Exception, e:
+                        log.exception(e)
+                        error = 'Could not gather %s: %s' % (row[u'id'], e)
+
+                # Record the error and carry on with the next dataset
+                if error is not None:
+                    self._save_gather_error(error, harvest_job)
+                    checkpoint['failed_ids'].append(row[u'id'])
+                    stats.incr('datasets_failed')
+                    continue
 
-                log.debug(de_rows)
-        except Exception:
+                if spec is not None:
+                    batch.append(spec)
+                if len(batch) >= batch_size:
+                    ids.extend(self._save_harvest_objects(batch, harvest_job))
+                    batch = []
+                    checkpoint['last_dataset_id'] = row[u'id']
+                    self._save_checkpoint(source_id, checkpoint)
+
+            # Withdraw the datasets which are no longer in the workbook
+            for guid in self._get_removed_guids(current, seen):
+                log.debug('adding %s to the queue for deletion' % guid)
+                stats.incr('datasets_removed')
+                batch.append({
+                    'guid': guid,
+                    'content': SFAPayload.encode({'deleted': True}),
+                    'fingerprint': None
+                })
+
+            ids.extend(self._save_harvest_objects(batch, harvest_job))
+            stats.incr('harvest_objects', len(ids))
+            self._remove_checkpoint(source_id)
+        except Exception, e:
+            log.exception(e)
+            self._save_gather_error(
+                'Gather stage failed: %s' % e,
+                harvest_job
+            )
             return False
+        finally:
+            stats.emit()
+        return ids
+
+    def _get_removed_guids(self, current, seen):
+        '''
+        Return the guids of the active packages harvested from the source
+        which are not in the workbook anymore
+        '''
+        if not seen:
+            # An empty workbook is more likely a broken upload
+            # than the withdrawal of every dataset
+            log.warning('No datasets in the workbook, nothing is deleted')
+            return []
+        active = set(
+            guid for guid, obj in current.items()
+            if obj['state'] == 'active'
+        )
+        return sorted(active - seen)
+
+    def _build_harvest_object(self, spec, harvest_job):
+        '''
+        Create the harvest object of a job from its guid, content
+        and fingerprint
+        '''
+        obj = HarvestObject(
+            guid=spec['guid'],
+            job=harvest_job,
+            content=spec['content']
+        )
+        if spec['fingerprint']:
+            HarvestObjectExtra(
+                object=obj,
+                key=self.FINGERPRINT_KEY,
+                value=spec['fingerprint']
+            )
+        return obj
+
+    def _save_harvest_objects(self, specs, harvest_job):
+        '''
+        Create and save a batch of harvest objects in one transaction
+        and return their ids in order
+
+        The objects are only created here, as linking them to the job
+        adds them to the session. If the batch fails, the objects are
+        created again and saved one by one and a gather error is
+        recorded for every object which can not be saved.
+        '''
+        if not specs:
+            return []
+
+        try:
+            with self._stats().timer('save_harvest_objects'):
+                harvest_objects = [
+                    self._build_harvest_object(spec, harvest_job)
+                    for spec in specs
+                ]
+                Session.add_all(harvest_objects)
+                Session.commit()
+            return [obj.id for obj in harvest_objects]
+        except Exception, e:
+            log.exception(e)
+            Session.rollback()
+
+        ids = []
+        for spec in specs:
+            try:
+                obj = self._build_harvest_object(spec, harvest_job)
+                Session.add(obj)
+                Session.commit()
+                ids.append(obj.id)
+            except Exception, e:
+                log.exception(e)
+                Session.rollback()
+                self._save_gather_error(
+                    'Could not save the harvest object %s: %s'
+                    % (spec['guid'], e),
+                    harvest_job
+                )
         return ids
 
     def fetch_stage(self, harvest_object):
         log.debug('In SFAHarvester fetch_stage')
 
-        # Get the URL
-        datasetID = json.loads(harvest_object.content)['datasetID']
+        self._start_stats(
+            self._get_job_stats(harvest_object.harvest_job_id, 'fetch')
+        )
+
+        payload = SFAPayload(harvest_object.content)
+        if payload.get('deleted'):
+            # Nothing to fetch for a dataset which is deleted
+            return True
+        datasetID = payload['datasetID']
         log.debug(harvest_object.content)
 
-        # Get contents
+        # Resolve the resources of the dataset on S3
         try:
+            dataset_id, files, error = self._list_dataset_files(datasetID)
+            if error is not None:
+                self._save_object_error(
+                    'Could not list the files of %s: %s' % (datasetID, error),
+                    harvest_object,
+                    'Fetch'
+                )
+                self._object_done(harvest_object.harvest_job_id)
+                return False
+
+            resources = self._generate_resources_dict_array(datasetID, files)
+            version = payload.pop('resources_version', None)
+            if resources and version is not None:
+                resources[0]['version'] = version
+            payload['resources'] = resources
+            log.debug(resources)
+
+            harvest_object.content = payload.encode_content()
             harvest_object.save()
             log.debug('successfully processed ' + datasetID)
             return True
         except Exception, e:
             log.exception(e)
+            self._object_done(harvest_object.harvest_job_id)
             raise
 
+    def _delete_package(self, harvest_object):
+        '''
+        Withdraw the package of a dataset which was removed from the
+        workbook, it is marked as deleted and can be restored
+        '''
+        context = {
+            'model': model,
+            'session': Session,
+            'user': self.config['user']
+        }
+        package = model.Package.get(harvest_object.guid)
+        if package is not None and package.state != 'deleted':
+            get_action('package_delete')(context, {'id': package.id})
+            log.info('Deleted package %s' % package.id)
+
+        # The dataset is not harvested from this source anymore
+        Session.query(HarvestObject) \
+            .filter(HarvestObject.guid == harvest_object.guid) \
+            .filter(HarvestObject.current) \
+            .update({'current': False}, synchronize_session=False)
+        if package is not None:
+            harvest_object.package_id = package.id
+        harvest_object.current = False
+        harvest_object.save()
+        Session.commit()
+
+    def _get_resource_key(self, url):
+        '''
+        Return the S3 key of a resource from its URL
+        '''
+        prefix = self.FILES_BASE_URL + '/'
+        if url and url.startswith(prefix):
+            return url[len(prefix):]
+        return url
+
+    def _diff_resources(self, package, resources):
+        '''
+        Match the harvested resources with the resources of an existing
+        package by S3 key and return how many are new, changed, unchanged
+        and deleted
+
+        The matched resources get the id of the existing resource, so
+        the package update changes them in place and only the changed
+        ones get a new revision. Resources which are not harvested
+        anymore are deleted by the package update.
+        '''
+        existing = dict(
+            (self._get_resource_key(resource.url), resource)
+            for resource in package.resources
+        )
+        delta = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+        for resource in resources:
+            key = self._get_resource_key(resource['url'])
+            current = existing.pop(key, None)
+            if current is None:
+                delta['created'] += 1
+                continue
+            resource['id'] = current.id
+            if current.hash == resource.get('hash'):
+                delta['unchanged'] += 1
+            else:
+                delta['updated'] += 1
+        delta['deleted'] = len(existing)
+        return delta
+
+    def _is_unchanged(self, package, fingerprint, delta):
+        '''
+        Whether an existing package was imported from the same content
+        and none of its resources changed
+        '''
+        if not fingerprint or package.state != 'active':
+            return False
+        if package.extras.get(self.FINGERPRINT_KEY) != fingerprint:
+            return False
+        return not (delta['created'] or delta['updated'] or delta['deleted'])
+
+    def _mark_current(self, harvest_object, package_id):
+        '''
+        Make a harvest object the current one of its package
+        '''
+        Session.query(HarvestObject) \
+            .filter(HarvestObject.package_id == package_id) \
+            .filter(HarvestObject.current) \
+            .update({'current': False}, synchronize_session=False)
+        harvest_object.package_id = package_id
+        harvest_object.current = True
+        harvest_object.save()
+
     def import_stage(self, harvest_object):
         log.debug('In SFAHarvester import_stage')
 
@@ -325,13 +1318,52 @@ class SFAHarvester(HarvesterBase):
             return False
 
         try:
-            package_dict = json.loads(harvest_object.content)
+            package_dict = SFAPayload(harvest_object.content).to_dict()
             package_dict['id'] = harvest_object.guid
-            package_dict['name'] = self._gen_new_name(
-                package_dict[u'title'],
-                package_dict['id']
+            stats = self._start_stats(
+                self._get_job_stats(harvest_object.harvest_job_id, 'import')
+            )
+            source_cache = self._get_source_cache(
+                harvest_object.job.source_id
             )
 
+            if package_dict.get('deleted'):
+                with stats.timer('delete_package'):
+                    self._delete_package(harvest_object)
+                stats.incr('packages_deleted')
+                return True
+
+            fingerprint = self._get_object_extra(
+                harvest_object,
+                self.FINGERPRINT_KEY
+            )
+
+            # Diff the resources with the ones of the existing package
+            # and leave a package without any change alone
+            package = model.Package.get(package_dict['id'])
+            if package is not None:
+                with stats.timer('resource_diff'):
+                    delta = self._diff_resources(
+                        package,
+                        package_dict.get('resources', [])
+                    )
+                for name, count in delta.items():
+                    stats.incr('resources_' + name, count)
+                log.debug('Resources of %s: %s' % (package.id, delta))
+
+                if self._is_unchanged(package, fingerprint, delta):
+                    log.debug('Package %s is unchanged' % package.id)
+                    self._mark_current(harvest_object, package.id)
+                    stats.incr('packages_unchanged')
+                    return True
+
+            with stats.timer('gen_new_name'):
+                package_dict['name'] = self._gen_new_name(
+                    package_dict[u'title'],
+                    package_dict['id'],
+                    source_cache
+                )
+
             user = model.User.get(self.config['user'])
             context = {
                 'model': model,
@@ -340,70 +1372,50 @@ class SFAHarvester(HarvesterBase):
             }
 
             # Find or create group the dataset should get assigned to
-            for group_name in package_dict['groups']:
-                try:
-                    data_dict = {
-                        'id': group_name,
-                        'name': munge_title_to_name(group_name),
-                        'title': group_name
-                    }
-                    group = get_action('group_show')(context, data_dict)
-                    log.info('found the group ' + group['id'])
-                except:
-                    group = get_action('group_create')(context, data_dict)
-                    log.info('created the group ' + group['id'])
+            with stats.timer('group_resolution'):
+                self._resolve_groups(
+                    context,
+                    package_dict['groups'],
+                    source_cache
+                )
 
             # Find or create the organization
             # the dataset should get assigned to.
-            data_dict = {
-                'permission': 'edit_group',
-                'id': munge_title_to_name(self.ORGANIZATION['de']['name']),
-                'name': munge_title_to_name(self.ORGANIZATION['de']['name']),
-                'title': self.ORGANIZATION['de']['name'],
-                'description': self.ORGANIZATION['de']['description'],
-                'extras': [
-                    {
-                        'key': 'website',
-                        'value': self.ORGANIZATION['de']['website']
-                    }
-                ]
-            }
-            try:
-                package_dict['owner_org'] = get_action('organization_show')(
-                    context,
-                    data_dict
-                )['id']
-            except:
-                organization = get_action('organization_create')(
+            with stats.timer('organization_resolution'):
+                package_dict['owner_org'] = self._resolve_organization(
                     context,
-                    data_dict
+                    source_cache
                 )
-                package_dict['owner_org'] = organization['id']
 
             # Save additional metadata in extras
             extras = []
             if 'license_url' in package_dict:
                 extras.append(('license_url', package_dict['license_url']))
+            if fingerprint:
+                extras.append((self.FINGERPRINT_KEY, fingerprint))
             package_dict['extras'] = extras
             log.debug('Extras %s' % extras)
 
             # Insert or update the package
-            package = model.Package.get(package_dict['id'])
             model.PackageRole(
                 package=package,
                 user=user,
                 role=model.Role.ADMIN
             )
 
-            self._create_or_update_package(package_dict, harvest_object)
+            with stats.timer('create_or_update_package'):
+                self._save_package(package_dict, harvest_object, source_cache)
 
             # Add the translations to the term_translations table
-            for translation in package_dict['translations']:
-                action.update.term_translation_update(context, translation)
-            Session.commit()
+            with stats.timer('translation_writes'):
+                self._update_term_translations(package_dict['translations'])
+                Session.commit()
+            stats.incr('packages_imported')
 
         except Exception, e:
             log.exception(e)
             raise
+        finally:
+            self._object_done(harvest_object.harvest_job_id)
 
         return True
@@ -0,0 +1,79 @@
+#coding: utf-8
+
+import time
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SFASourceCache(object):
+    '''
+    Lookups shared by all imports of one harvest source in a process
+
+    The lookups are loaded on first use. The cache is replaced once it
+    is older than max_age seconds, as other processes and users change
+    groups, organizations and package names meanwhile.
+    '''
+
+    def __init__(self, source_id, max_age):
+        self.source_id = source_id
+        self.max_age = max_age
+        self.created = time.time()
+
+        # Ids of the existing groups and organizations,
+        # keyed by their id and their name
+        self.groups = None
+        self.organizations = None
+
+        # Package ids keyed by name and names keyed by package id
+        self.names = None
+        self.names_by_id = None
+
+        self._lock = threading.RLock()
+
+    def is_expired(self):
+        return time.time() - self.created >= self.max_age
+
+    def ensure_names(self, load):
+        '''
+        Fill the name index from the (name, id) rows
+        returned by load(), unless it is filled already
+        '''
+        with self._lock:
+            if self.names is None:
+                self.load_names(load())
+
+    def load_names(self, rows):
+        '''
+        Fill the name index from (name, id) rows
+        '''
+        with self._lock:
+            self.names = {}
+            self.names_by_id = {}
+            for name, package_id in rows:
+                self.names[name] = package_id
+                self.names_by_id[package_id] = name
+
+    def set_name(self, name, package_id):
+        '''
+        Record the name of a package, replacing its previous name
+        '''
+        with self._lock:
+            old_name = self.names_by_id.get(package_id)
+            if old_name is not None \
+                    and self.names.get(old_name) == package_id:
+                del self.names[old_name]
+            self.names[name] = package_id
+            if package_id is not None:
+                self.names_by_id[package_id] = name
+
+    def refresh_name(self, name, package_id):
+        '''
+        Record the current owner of a name, None if it is unused
+        '''
+        with self._lock:
+            if package_id is None:
+                self.names.pop(name, None)
+            else:
+                self.set_name(name, package_id)
@@ -0,0 +1,333 @@
+#coding: utf-8
+
+import os
+import glob
+import json
+import time
+import atexit
+import socket
+import threading
+from contextlib import contextmanager
+
+from pylons import config
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def _get_interval():
+    return int(config.get('ckanext.sfa.stats_interval', 60))
+
+
+class SFAHarvestStats(object):
+    '''
+    Timers and counters of one stage of a harvest job
+
+    The stats are emitted as a structured log line and, if configured,
+    sent to statsd (ckanext.sfa.statsd_host = host:port) and written
+    as a Prometheus textfile (ckanext.sfa.prometheus_textfile_dir).
+    '''
+
+    def __init__(self, stage, job_id=None):
+        self.stage = stage
+        self.job_id = job_id
+        self.timers = {}
+        self.counters = {}
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+        # Values already sent to statsd, which only gets the increments
+        self._sent = {}
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            count, total = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (count + 1, total + seconds)
+            self.updated = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.updated = time.time()
+
+    def timed_iter(self, name, iterable):
+        '''
+        Yield from an iterable, timing every step
+        '''
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.time() - start)
+                return
+            self.add_time(name, time.time() - start)
+            yield item
+
+    def is_empty(self):
+        with self._lock:
+            return not (self.timers or self.counters)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'stage': self.stage,
+                'job_id': self.job_id,
+                'timers': dict(
+                    (name, {'count': count, 'seconds': round(total, 6)})
+                    for name, (count, total) in self.timers.items()
+                ),
+                'counters': dict(self.counters)
+            }
+
+    def emit(self):
+        log.info('SFA harvest stats %s' % json.dumps(self.to_dict()))
+        try:
+            if config.get('ckanext.sfa.statsd_host'):
+                self._send_statsd(config.get('ckanext.sfa.statsd_host'))
+            if config.get('ckanext.sfa.prometheus_textfile_dir'):
+                self._write_textfile(
+                    config.get('ckanext.sfa.prometheus_textfile_dir')
+                )
+        except Exception, e:
+            log.exception(e)
+
+    def _send_statsd(self, address):
+        host, port = address.rsplit(':', 1)
+        prefix = 'sfa.harvest.%s.' % self.stage
+        lines = []
+        with self._lock:
+            for name, (count, total) in self.timers.items():
+                sent = self._sent.get(('timer', name), 0.0)
+                if total > sent:
+                    lines.append(
+                        '%s%s:%d|ms' % (prefix, name, (total - sent) * 1000)
+                    )
+                self._sent[('timer', name)] = total
+            for name, value in self.counters.items():
+                sent = self._sent.get(('counter', name), 0)
+                if value > sent:
+                    lines.append('%s%s:%d|c' % (prefix, name, value - sent))
+                self._sent[('counter', name)] = value
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for line in lines:
+                sock.sendto(line, (host, int(port)))
+        finally:
+            sock.close()
+
+    def _write_textfile(self, directory):
+        '''
+        Write the stats to the textfile of this stage, job and process,
+        several jobs and harvester processes may run on the same host
+        '''
+        lines = [
+            '# TYPE sfa_harvest_seconds gauge',
+            '# TYPE sfa_harvest_calls gauge',
+            '# TYPE sfa_harvest_count gauge',
+        ]
+        with self._lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+        pid = os.getpid()
+        labels = 'stage="%s",job="%s",pid="%d"' % (
+            self.stage, self.job_id, pid
+        )
+        for name, (count, total) in timers:
+            timer_labels = '%s,timer="%s"' % (labels, name)
+            lines.append('sfa_harvest_seconds{%s} %f' % (timer_labels, total))
+            lines.append('sfa_harvest_calls{%s} %d' % (timer_labels, count))
+        for name, value in counters:
+            lines.append(
+                'sfa_harvest_count{%s,counter="%s"} %d' % (labels, name, value)
+            )
+
+        # Write to a temp file first, the collector may read at any time
+        path = os.path.join(
+            directory,
+            'sfa_harvest_%s_%d_%s.prom' % (self.stage, pid, self.job_id)
+        )
+        with open(path + '.tmp', 'w') as textfile:
+            textfile.write('\n'.join(lines) + '\n')
+        os.rename(path + '.tmp', path)
+
+        # The files of finished jobs are kept for two stats intervals,
+        # so they are collected at least once
+        remove_textfiles(max_age=2 * _get_interval())
+
+
+def remove_textfiles(max_age=None):
+    '''
+    Remove the Prometheus textfiles of this process,
+    only the ones older than max_age seconds if given
+    '''
+    directory = config.get('ckanext.sfa.prometheus_textfile_dir')
+    if not directory:
+        return
+    now = time.time()
+    pattern = os.path.join(directory, 'sfa_harvest_*_%d_*.prom' % os.getpid())
+    for path in glob.glob(pattern):
+        try:
+            if max_age is None or now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+class NullStats(SFAHarvestStats):
+    '''
+    Stats which are collected but never emitted, used
+    when no stage is active in the current thread
+    '''
+
+    def __init__(self):
+        super(NullStats, self).__init__('none')
+
+    def emit(self):
+        pass
+
+
+class SFAJobStats(object):
+    '''
+    The fetch and import stats of one harvest job in this process
+    '''
+
+    STAGES = ('fetch', 'import')
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.stages = dict(
+            (stage, SFAHarvestStats(stage, job_id)) for stage in self.STAGES
+        )
+        self._lock = threading.Lock()
+
+        # The number of harvest objects of the job, if it is known,
+        # and how many of them were processed
+        self.objects_total = None
+        self.objects_done = 0
+
+    def updated(self):
+        return max(stats.updated for stats in self.stages.values())
+
+    def object_done(self):
+        '''
+        Count a processed harvest object of the job,
+        returns True for the last one
+        '''
+        with self._lock:
+            self.objects_done += 1
+            return self.objects_total is not None \
+                and self.objects_done >= self.objects_total
+
+    def emit(self):
+        '''
+        Emit the stats of the stages which collected any
+        '''
+        for stage in self.STAGES:
+            if not self.stages[stage].is_empty():
+                self.stages[stage].emit()
+
+
+class SFAJobStatsRegistry(object):
+    '''
+    The stats of the harvest jobs in progress, shared by all
+    threads of the process
+
+    The stats of a job are emitted after its last harvest object, every
+    ckanext.sfa.stats_interval seconds (default 60) while the job is in
+    progress, and when the process exits.
+    '''
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def get(self, job_id, count_objects):
+        '''
+        Return the stats of a job, count_objects(job_id)
+        returns the number of harvest objects of a new job
+        '''
+        with self._lock:
+            self._start_flusher()
+            job_stats = self._jobs.get(job_id)
+            if job_stats is not None:
+                return job_stats
+            job_stats = self._jobs[job_id] = SFAJobStats(job_id)
+
+        # Objects of other processes are counted as well, the stats of
+        # a process only processing some of them are emitted when idle
+        job_stats.objects_total = count_objects(job_id)
+        return job_stats
+
+    def object_done(self, job_id, count_objects):
+        '''
+        Count a processed harvest object and emit the stats
+        of its job after the last one
+        '''
+        if self.get(job_id, count_objects).object_done():
+            with self._lock:
+                job_stats = self._jobs.pop(job_id, None)
+            if job_stats is not None:
+                job_stats.emit()
+
+    def flush(self, idle=None):
+        '''
+        Emit the stats of all jobs in progress
+
+        The stats of jobs without any activity for idle seconds,
+        or of all jobs if idle is None, are dropped afterwards.
+        '''
+        now = time.time()
+        with self._lock:
+            jobs = self._jobs.items()
+            for job_id, job_stats in jobs:
+                if idle is None or now - job_stats.updated() >= idle:
+                    del self._jobs[job_id]
+        for job_id, job_stats in jobs:
+            job_stats.emit()
+
+    def shutdown(self):
+        '''
+        Emit the stats of all jobs in progress and remove the
+        textfiles of the process, called when it exits
+        '''
+        try:
+            self.flush()
+            remove_textfiles()
+        except Exception, e:
+            log.exception(e)
+
+    def _start_flusher(self):
+        '''
+        Start the thread emitting the stats of the jobs in progress,
+        called with the lock held
+        '''
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(
+            target=self._flush_loop,
+            name='sfa-harvest-stats'
+        )
+        self._flusher.daemon = True
+        self._flusher.start()
+        atexit.register(self.shutdown)
+
+    def _flush_loop(self):
+        while True:
+            interval = _get_interval()
+            time.sleep(interval)
+            try:
+                self.flush(idle=interval)
+                remove_textfiles(max_age=2 * interval)
+            except Exception, e:
+                log.exception(e)
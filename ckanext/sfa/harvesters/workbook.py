@@ -0,0 +1,357 @@
+#coding: utf-8
+
+import zipfile
+import tempfile
+import posixpath
+from array import array
+from xml.etree import cElementTree
+
+import logging
+log = logging.getLogger(__name__)
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = (
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+)
+PACKAGE_RELATIONSHIPS_NS = (
+    'http://schemas.openxmlformats.org/package/2006/relationships'
+)
+XML_SPACE_ATTR = '{http://www.w3.org/XML/1998/namespace}space'
+XML_WHITESPACE = '\t\n \r'
+
+# The codes xlrd returns for error cells
+ERROR_CODES = {
+    '#NULL!': 0x00,
+    '#DIV/0!': 0x07,
+    '#VALUE!': 0x0F,
+    '#REF!': 0x17,
+    '#NAME?': 0x1D,
+    '#NUM!': 0x24,
+    '#N/A': 0x2A,
+}
+
+
+def _tag(name, namespace=SPREADSHEET_NS):
+    return '{%s}%s' % (namespace, name)
+
+
+ROW_TAG = _tag('row')
+CELL_TAG = _tag('c')
+VALUE_TAG = _tag('v')
+TEXT_TAG = _tag('t')
+RUN_TAG = _tag('r')
+INLINE_STRING_TAG = _tag('is')
+
+
+def _column_index(cell_reference):
+    '''
+    Return the zero based column index of a cell reference like "AB7"
+    '''
+    index = 0
+    for char in cell_reference:
+        if char.isdigit():
+            break
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+class SharedStrings(object):
+    '''
+    The shared strings of an .xlsx workbook, spooled to a temporary file
+
+    Only the offset of every string is kept in memory, eight bytes per
+    string, the strings are read back from the file when a cell refers
+    to them.
+    '''
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._offsets = array('l', [0])
+
+    def append(self, text):
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            raise IndexError('shared string index out of range')
+        start = self._offsets[index]
+        end = self._offsets[index + 1]
+        self._file.seek(start)
+        return self._file.read(end - start).decode('utf-8')
+
+    def close(self):
+        self._file.close()
+
+
+class XLSXRowReader(object):
+    '''
+    Reads the rows of an .xlsx workbook one by one
+
+    xlrd loads every sheet of an .xlsx file completely (on_demand is
+    not implemented for them), this reader parses the sheet XML
+    incrementally so only one row is kept in memory. The shared strings
+    are spooled to a temporary file, only their offsets stay in memory.
+    Cell values are returned like xlrd's row_values does: text as
+    unicode, numbers and dates as float, booleans as int, errors as
+    their xlrd error code and empty cells as u''.
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._shared_strings = None
+        self._sheet_paths = None
+
+    def _open(self):
+        return zipfile.ZipFile(self.file_path)
+
+    def _load_sheet_paths(self, archive):
+        '''
+        Return the paths of the worksheets in workbook order
+        '''
+        targets = {}
+        rels = cElementTree.fromstring(
+            archive.read('xl/_rels/workbook.xml.rels')
+        )
+        for rel in rels.iter(_tag('Relationship', PACKAGE_RELATIONSHIPS_NS)):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[rel.get('Id')] = target
+
+        workbook = cElementTree.fromstring(archive.read('xl/workbook.xml'))
+        return [
+            targets[sheet.get(_tag('id', RELATIONSHIPS_NS))]
+            for sheet in workbook.iter(_tag('sheet'))
+        ]
+
+    def _load_shared_strings(self, archive):
+        shared_strings = SharedStrings()
+        if 'xl/sharedStrings.xml' not in archive.namelist():
+            return shared_strings
+        source = archive.open('xl/sharedStrings.xml')
+        root = None
+        events = cElementTree.iterparse(source, events=('start', 'end'))
+        for event, elem in events:
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == _tag('si'):
+                shared_strings.append(self._get_text(elem))
+                # Drop the parsed strings from the tree as well
+                root.clear()
+        source.close()
+        return shared_strings
+
+    def _get_text(self, elem):
+        '''
+        Return the text of a string item, without phonetic runs
+        '''
+        text = []
+        for child in elem:
+            if child.tag == TEXT_TAG:
+                text.append(self._cooked_text(child))
+            elif child.tag == RUN_TAG:
+                for t in child.findall(TEXT_TAG):
+                    text.append(self._cooked_text(t))
+        return unicode(u''.join(text))
+
+    def _cooked_text(self, elem):
+        '''
+        Return the text of an element, stripped like xlrd does
+        unless its whitespace is marked to be preserved
+        '''
+        text = elem.text or u''
+        if elem.get(XML_SPACE_ATTR) != 'preserve':
+            text = text.strip(XML_WHITESPACE)
+        return text
+
+    def _get_value(self, cell):
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            inline = cell.find(INLINE_STRING_TAG)
+            return self._get_text(inline) if inline is not None else u''
+
+        value = cell.findtext(VALUE_TAG)
+        if value is None:
+            return u''
+        if cell_type == 's':
+            return self._shared_strings[int(value)]
+        if cell_type == 'e':
+            return ERROR_CODES.get(value, value)
+        if cell_type == 'str':
+            return unicode(value)
+        if cell_type == 'b':
+            return int(value)
+        return float(value)
+
+    def iter_rows(self, sheet_index):
+        '''
+        Yield the values of every row of a sheet as a list,
+        missing rows are yielded as empty lists
+        '''
+        archive = self._open()
+        try:
+            if self._sheet_paths is None:
+                self._sheet_paths = self._load_sheet_paths(archive)
+            if self._shared_strings is None:
+                self._shared_strings = self._load_shared_strings(archive)
+
+            source = archive.open(self._sheet_paths[sheet_index])
+            row_num = 0
+            sheet_data = None
+            events = cElementTree.iterparse(source, events=('start', 'end'))
+            for event, elem in events:
+                if event == 'start':
+                    if elem.tag == _tag('sheetData'):
+                        sheet_data = elem
+                    continue
+                if elem.tag != ROW_TAG:
+                    continue
+
+                if elem.get('r'):
+                    while row_num < int(elem.get('r')) - 1:
+                        yield []
+                        row_num += 1
+
+                values = []
+                for cell in elem.iter(CELL_TAG):
+                    reference = cell.get('r')
+                    if reference:
+                        col_index = _column_index(reference)
+                    else:
+                        col_index = len(values)
+                    while len(values) < col_index:
+                        values.append(u'')
+                    values.append(self._get_value(cell))
+
+                # Drop the parsed rows so memory stays bounded
+                sheet_data.clear()
+
+                yield values
+                row_num += 1
+            source.close()
+        finally:
+            archive.close()
+
+
+class XLSRowReader(object):
+    '''
+    Reads the rows of a legacy .xls workbook with xlrd
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._workbook = None
+
+    def iter_rows(self, sheet_index):
+        if self._workbook is None:
+            import xlrd
+            self._workbook = xlrd.open_workbook(
+                self.file_path,
+                on_demand=True
+            )
+        worksheet = self._workbook.sheet_by_index(sheet_index)
+        for row_num in range(worksheet.nrows):
+            yield worksheet.row_values(row_num)
+        self._workbook.unload_sheet(sheet_index)
+
+
+class SFAWorkbook(object):
+    '''
+    The SFA metadata workbook with one sheet per language
+
+    The rows are streamed from the file, so memory does not grow with
+    the number of datasets. Every call to one of the iterators reads
+    the sheets again.
+    '''
+
+    # The header is on row 6 (7 in Excel),
+    # data rows begin at row 7 (8 in Excel)
+    HEADER_ROW = 6
+    FIRST_DATA_ROW = 7
+
+    def __init__(self, file_path, lang_codes):
+        self.file_path = file_path
+        self.lang_codes = lang_codes
+
+        if zipfile.is_zipfile(file_path):
+            self.reader = XLSXRowReader(file_path)
+        else:
+            self.reader = XLSRowReader(file_path)
+
+    def iter_rows(self, lang_code):
+        '''
+        Yield the rows of a language sheet as dicts keyed by the header
+        '''
+        header_row = None
+        sheet_index = self.lang_codes.index(lang_code)
+        try:
+            for row_num, values in enumerate(
+                    self.reader.iter_rows(sheet_index)):
+                if row_num == self.HEADER_ROW:
+                    header_row = values
+                elif row_num >= self.FIRST_DATA_ROW:
+                    # Skip blank rows at the end of the sheet
+                    if not any(values):
+                        continue
+                    values = values + [u''] * (len(header_row) - len(values))
+                    yield dict(zip(header_row, values))
+        except Exception, e:
+            log.exception(e)
+            raise
+
+    def dataset_ids(self):
+        '''
+        Return the ids of all datasets in workbook order
+        '''
+        return [row[u'id'] for row in self.iter_rows(self.lang_codes[0])]
+
+    def iter_datasets(self):
+        '''
+        Yield the rows of every dataset in all languages side by side,
+        as dicts keyed by language code
+
+        The rows of the other sheets are matched by dataset id. As long
+        as they are in the same order as the first sheet, they are
+        streamed alongside it. A sheet in a different order is read
+        into an index by dataset id instead. Missing rows are None.
+        '''
+        main_lang = self.lang_codes[0]
+        other_langs = self.lang_codes[1:]
+        streams = dict(
+            (lang_code, self.iter_rows(lang_code))
+            for lang_code in other_langs
+        )
+        indexes = {}
+
+        for main_row in self.iter_rows(main_lang):
+            dataset_id = main_row[u'id']
+            rows = {main_lang: main_row}
+            for lang_code in other_langs:
+                if lang_code in indexes:
+                    rows[lang_code] = indexes[lang_code].get(dataset_id)
+                    continue
+
+                row = next(streams[lang_code], None)
+                if row is not None and row[u'id'] == dataset_id:
+                    rows[lang_code] = row
+                    continue
+
+                log.warning(
+                    'The %s sheet is not in the same order as the %s sheet, '
+                    'reading it into an index' % (lang_code, main_lang)
+                )
+                indexes[lang_code] = dict(
+                    (other_row[u'id'], other_row)
+                    for other_row in self.iter_rows(lang_code)
+                )
+                rows[lang_code] = indexes[lang_code].get(dataset_id)
+            yield rows
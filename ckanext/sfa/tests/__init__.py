@@ -0,0 +1,18 @@
+import os
+import imp
+
+HARVESTERS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'harvesters'
+)
+
+
+def load_harvester_module(name):
+    '''
+    Load a module of the harvesters package on its own,
+    the package itself imports CKAN
+    '''
+    return imp.load_source(
+        'ckanext_sfa_' + name,
+        os.path.join(HARVESTERS_DIR, name + '.py')
+    )
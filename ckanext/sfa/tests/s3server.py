@@ -0,0 +1,133 @@
+#coding: utf-8
+'''
+A local stand-in for S3, serving one bucket over HTTP to boto
+
+Supports listing the bucket in pages of up to 1000 keys and conditional
+downloads of keys with If-None-Match, which is all the harvester uses.
+'''
+
+import cgi
+import hashlib
+import threading
+import urllib
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+
+MAX_KEYS = 1000
+
+LAST_MODIFIED = '2014-03-01T12:00:00.000Z'
+
+
+class S3RequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        url = urlparse.urlparse(self.path)
+        bucket_name, _, key = url.path.lstrip('/').partition('/')
+        key = urllib.unquote(key).decode('utf-8')
+        self.server.requests.append((self.command, self.path))
+
+        if bucket_name != self.server.bucket_name:
+            return self.respond(
+                404, '<Error><Code>NoSuchBucket</Code></Error>'
+            )
+        if not key:
+            params = dict(
+                (name, values[0])
+                for name, values in cgi.parse_qs(url.query).items()
+            )
+            return self.respond(200, self.list_keys(params), body=body)
+        if key not in self.server.keys:
+            return self.respond(404, '<Error><Code>NoSuchKey</Code></Error>')
+
+        data = self.server.keys[key]
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            return self.respond(304, '', body=False)
+        self.respond(200, data, {'ETag': etag}, body)
+
+    def list_keys(self, params):
+        max_keys = min(int(params.get('max-keys', MAX_KEYS)), MAX_KEYS)
+        keys = sorted(
+            key for key in self.server.keys
+            if key.startswith(params.get('prefix', '').decode('utf-8'))
+            and key > params.get('marker', '').decode('utf-8')
+        )
+        contents = ''.join(
+            '<Contents><Key>%s</Key><LastModified>%s</LastModified>'
+            '<ETag>&quot;%s&quot;</ETag><Size>%d</Size>'
+            '<StorageClass>STANDARD</StorageClass></Contents>' % (
+                escape(key.encode('utf-8')),
+                LAST_MODIFIED,
+                hashlib.md5(self.server.keys[key]).hexdigest(),
+                len(self.server.keys[key])
+            )
+            for key in keys[:max_keys]
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult>'
+            '<Name>%s</Name><Prefix>%s</Prefix><Marker>%s</Marker>'
+            '<MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>%s'
+            '</ListBucketResult>' % (
+                self.server.bucket_name,
+                escape(params.get('prefix', '')),
+                escape(params.get('marker', '')),
+                max_keys,
+                'true' if len(keys) > max_keys else 'false',
+                contents
+            )
+        )
+
+    def respond(self, status, data, headers=None, body=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+
+class S3Server(ThreadingMixIn, HTTPServer):
+    '''
+    Serves the keys of one bucket on a free local port
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, bucket_name):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), S3RequestHandler)
+        self.bucket_name = bucket_name
+        self.keys = {}
+        self.requests = []
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def connect(self):
+        '''
+        Return a boto connection to the server
+        '''
+        return S3Connection(
+            'access-key', 'secret-key',
+            host=self.server_address[0],
+            port=self.server_address[1],
+            is_secure=False,
+            calling_format=OrdinaryCallingFormat()
+        )
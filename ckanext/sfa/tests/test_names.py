@@ -0,0 +1,120 @@
+#coding: utf-8
+'''
+Checks the name generation helpers and the name index of the SFA harvester
+
+Runs without CKAN: nosetests ckanext/sfa/tests/test_names.py
+'''
+
+import time
+import unittest
+
+from ckanext.sfa.tests import load_harvester_module
+
+normalize = load_harvester_module('normalize')
+sourcecache = load_harvester_module('sourcecache')
+
+PACKAGE_ID = u'3f2a9c4e-1b7d-5e6f-8a9b-0c1d2e3f4a5b'
+OTHER_ID = u'7c6b5a49-3827-5160-9f8e-7d6c5b4a3928'
+
+
+class TestNameCandidates(unittest.TestCase):
+
+    def test_suffixes_are_derived_from_the_id(self):
+        candidates = normalize.name_candidates(u'bevoelkerung', PACKAGE_ID)
+        self.assertEqual(
+            [next(candidates) for num in range(4)],
+            [
+                u'bevoelkerung',
+                u'bevoelkerung-3f2a9',
+                u'bevoelkerung-3f2a9c',
+                u'bevoelkerung-3f2a9c4',
+            ]
+        )
+
+    def test_same_names_on_every_import(self):
+        self.assertEqual(
+            list(normalize.name_candidates(u'name', PACKAGE_ID)),
+            list(normalize.name_candidates(u'name', PACKAGE_ID))
+        )
+
+    def test_candidates_end_with_the_whole_id(self):
+        candidates = list(normalize.name_candidates(u'name', u'abcdef'))
+        self.assertEqual(
+            candidates,
+            [u'name', u'name-abcde', u'name-abcdef']
+        )
+
+
+class TestSFASourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = sourcecache.SFASourceCache(u'source', max_age=3600)
+        self.cache.load_names([
+            (u'bevoelkerung', OTHER_ID),
+            (u'old-name', PACKAGE_ID),
+        ])
+
+    def free_name(self, name, package_id):
+        '''
+        Pick a name like the harvester does with an up to date index
+        '''
+        for candidate in normalize.name_candidates(name, package_id):
+            if self.cache.names.get(candidate) in (None, package_id):
+                self.cache.set_name(candidate, package_id)
+                return candidate
+
+    def test_collision_gets_the_id_suffix(self):
+        self.assertEqual(
+            self.free_name(u'bevoelkerung', PACKAGE_ID),
+            u'bevoelkerung-3f2a9'
+        )
+        # Imported again, the package keeps its name
+        self.assertEqual(
+            self.free_name(u'bevoelkerung', PACKAGE_ID),
+            u'bevoelkerung-3f2a9'
+        )
+
+    def test_set_name_replaces_the_old_name(self):
+        self.cache.set_name(u'new-name', PACKAGE_ID)
+        self.assertNotIn(u'old-name', self.cache.names)
+        self.assertEqual(self.cache.names[u'new-name'], PACKAGE_ID)
+        self.assertEqual(self.cache.names_by_id[PACKAGE_ID], u'new-name')
+
+    def test_set_name_keeps_a_name_taken_by_another_package(self):
+        self.cache.names[u'old-name'] = OTHER_ID
+        self.cache.set_name(u'new-name', PACKAGE_ID)
+        self.assertEqual(self.cache.names[u'old-name'], OTHER_ID)
+
+    def test_refresh_name(self):
+        self.cache.refresh_name(u'bevoelkerung', None)
+        self.assertNotIn(u'bevoelkerung', self.cache.names)
+        self.assertEqual(
+            self.free_name(u'bevoelkerung', PACKAGE_ID),
+            u'bevoelkerung'
+        )
+
+        self.cache.refresh_name(u'taken', OTHER_ID)
+        self.assertEqual(self.cache.names[u'taken'], OTHER_ID)
+        self.assertEqual(self.cache.names_by_id[OTHER_ID], u'taken')
+
+    def test_names_are_loaded_once(self):
+        cache = sourcecache.SFASourceCache(u'source', max_age=3600)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return [(u'name', PACKAGE_ID)]
+
+        cache.ensure_names(load)
+        cache.ensure_names(load)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(cache.names, {u'name': PACKAGE_ID})
+
+    def test_is_expired(self):
+        self.assertFalse(self.cache.is_expired())
+        self.cache.created = time.time() - 3600
+        self.assertTrue(self.cache.is_expired())
+
+
+if __name__ == '__main__':
+    unittest.main()
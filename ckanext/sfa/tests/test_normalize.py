@@ -0,0 +1,109 @@
+#coding: utf-8
+'''
+Checks the tag splitting and the normalisation cache of the SFA harvester
+
+Runs without CKAN: nosetests ckanext/sfa/tests/test_normalize.py
+'''
+
+import threading
+import unittest
+
+from ckanext.sfa.tests import load_harvester_module
+
+normalize = load_harvester_module('normalize')
+
+
+class TestSplitTags(unittest.TestCase):
+
+    def test_separators(self):
+        self.assertEqual(
+            normalize.split_tags(u'Bevölkerung, Gemeinden;Kantone ; Bund'),
+            [u'Bevölkerung', u'Gemeinden', u'Kantone', u'Bund']
+        )
+
+    def test_whitespace(self):
+        self.assertEqual(
+            normalize.split_tags(u'  a ,\tb\n,c  '),
+            [u'a', u'b', u'c']
+        )
+
+    def test_empty_tags_are_dropped(self):
+        self.assertEqual(normalize.split_tags(u'a,, ;b;'), [u'a', u'b'])
+        self.assertEqual(normalize.split_tags(u''), [])
+        self.assertEqual(normalize.split_tags(u' ; '), [])
+
+    def test_spaces_within_a_tag_are_kept(self):
+        self.assertEqual(
+            normalize.split_tags(u'öffentliche Finanzen, Steuern'),
+            [u'öffentliche Finanzen', u'Steuern']
+        )
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.computed = []
+
+    def compute(self, key):
+        self.computed.append(key)
+        return key.upper()
+
+    def test_values_are_computed_once(self):
+        cache = normalize.LRUCache(10)
+        self.assertEqual(cache.get('a', self.compute), 'A')
+        self.assertEqual(cache.get('a', self.compute), 'A')
+        self.assertEqual(self.computed, ['a'])
+        self.assertEqual(
+            cache.info(),
+            {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10}
+        )
+
+    def test_least_recently_used_is_dropped(self):
+        cache = normalize.LRUCache(2)
+        cache.get('a', self.compute)
+        cache.get('b', self.compute)
+        cache.get('a', self.compute)
+        cache.get('c', self.compute)
+        self.assertEqual(cache.info()['size'], 2)
+
+        # b was used least recently and is computed again
+        del self.computed[:]
+        cache.get('a', self.compute)
+        cache.get('c', self.compute)
+        cache.get('b', self.compute)
+        self.assertEqual(self.computed, ['b'])
+
+    def test_clear(self):
+        cache = normalize.LRUCache(10)
+        cache.get('a', self.compute)
+        cache.clear()
+        self.assertEqual(
+            cache.info(),
+            {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 10}
+        )
+        cache.get('a', self.compute)
+        self.assertEqual(self.computed, ['a', 'a'])
+
+    def test_shared_between_threads(self):
+        cache = normalize.LRUCache(50)
+        keys = ['key%d' % num for num in range(100)]
+        wrong = []
+
+        def use_cache():
+            for key in keys * 5:
+                if cache.get(key, str.upper) != key.upper():
+                    wrong.append(key)
+
+        threads = [threading.Thread(target=use_cache) for num in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(wrong, [])
+        info = cache.info()
+        self.assertEqual(info['size'], 50)
+        self.assertEqual(info['hits'] + info['misses'], 4 * 5 * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#coding: utf-8
+'''
+Checks the harvest object content format of the SFA harvester
+
+Runs without CKAN: nosetests ckanext/sfa/tests/test_payload.py
+'''
+
+import json
+import unittest
+
+from ckanext.sfa.tests import load_harvester_module
+
+payload = load_harvester_module('payload')
+
+METADATA = {
+    'datasetID': u'ch.bar.dataset1',
+    'title': u'Bevölkerung',
+    'groups': [u'Gruppe'],
+    'resources_version': u'1.0',
+    'resources': [
+        {
+            'url': u'http://bucket.s3.amazonaws.com/ch.bar.dataset1/a.csv',
+            'name': u'a.csv',
+            'size': 12
+        }
+    ],
+    'translations': [
+        {
+            'lang_code': u'fr',
+            'term': u'Bevölkerung',
+            'term_translation': u'Population'
+        },
+        {
+            'lang_code': u'it',
+            'term': u'Bevölkerung',
+            'term_translation': u'Popolazione'
+        }
+    ]
+}
+
+
+class TestSFAPayload(unittest.TestCase):
+
+    def test_version_1_is_read(self):
+        # Harvest objects saved before the versioned format
+        content = json.dumps(METADATA)
+        data = payload.SFAPayload(content)
+        self.assertEqual(data.version, 1)
+        self.assertEqual(data['title'], METADATA['title'])
+        self.assertEqual(data['resources'], METADATA['resources'])
+        self.assertEqual(data['translations'], METADATA['translations'])
+        self.assertEqual(data.to_dict(), METADATA)
+
+    def test_version_1_is_encoded_as_version_2(self):
+        data = payload.SFAPayload(json.dumps(METADATA))
+        content = data.encode_content()
+        self.assertTrue(content.startswith(payload.SFAPayload.PREFIX))
+        self.assertEqual(payload.SFAPayload(content).to_dict(), METADATA)
+
+    def test_version_2_round_trip(self):
+        content = payload.SFAPayload.encode(METADATA)
+        self.assertTrue(content.startswith(u'sfa:2:'))
+
+        # Stored as unicode by the database
+        data = payload.SFAPayload(unicode(content))
+        self.assertEqual(data.version, 2)
+        self.assertEqual(sorted(data.keys()), sorted(METADATA.keys()))
+        self.assertEqual(data.to_dict(), METADATA)
+
+    def test_version_2_is_smaller(self):
+        metadata = dict(METADATA, translations=METADATA['translations'] * 50)
+        self.assertLess(
+            len(payload.SFAPayload.encode(metadata)),
+            len(json.dumps(metadata)) / 4
+        )
+
+    def test_sections_are_decoded_lazily(self):
+        data = payload.SFAPayload(payload.SFAPayload.encode(METADATA))
+        self.assertEqual(data['title'], METADATA['title'])
+        self.assertEqual(data._sections, {})
+        self.assertEqual(data['resources'], METADATA['resources'])
+        self.assertEqual(data._sections.keys(), ['resources'])
+
+    def test_encode_content_after_setitem(self):
+        data = payload.SFAPayload(payload.SFAPayload.encode(METADATA))
+        resources = [{'url': u'http://example.com/b.csv', 'name': u'b.csv'}]
+        data['resources'] = resources
+        data['title'] = u'Neu'
+
+        decoded = payload.SFAPayload(data.encode_content())
+        self.assertEqual(decoded['resources'], resources)
+        self.assertEqual(decoded['title'], u'Neu')
+        self.assertEqual(decoded['translations'], METADATA['translations'])
+
+    def test_encode_content_after_pop(self):
+        data = payload.SFAPayload(payload.SFAPayload.encode(METADATA))
+        self.assertEqual(data.pop('resources_version'), u'1.0')
+        self.assertEqual(data.pop('resources_version', u'none'), u'none')
+        self.assertEqual(data.pop('resources'), METADATA['resources'])
+        self.assertNotIn('resources', data)
+
+        decoded = payload.SFAPayload(data.encode_content())
+        self.assertNotIn('resources_version', decoded)
+        self.assertNotIn('resources', decoded)
+        self.assertEqual(decoded['translations'], METADATA['translations'])
+
+    def test_deleted_payload(self):
+        data = payload.SFAPayload(payload.SFAPayload.encode({'deleted': True}))
+        self.assertTrue(data.get('deleted'))
+        self.assertEqual(data.get('resources'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
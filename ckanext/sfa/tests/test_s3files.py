@@ -0,0 +1,161 @@
+#coding: utf-8
+'''
+Checks the S3 access of the SFA harvester with boto
+against a local stand-in for S3
+
+Runs without CKAN: nosetests ckanext/sfa/tests/test_s3files.py
+'''
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from boto.exception import S3ResponseError
+
+from ckanext.sfa.tests import load_harvester_module
+from ckanext.sfa.tests.s3server import S3Server
+
+s3files = load_harvester_module('s3files')
+
+BUCKET_NAME = 'opendata-bar'
+METADATA_FILE_NAME = u'OGD@Bund Metadaten BAR.xlsx'
+DEPARTMENT_BASE = u'ch.bar.'
+FILES_BASE_URL = 'http://%s.s3.amazonaws.com' % BUCKET_NAME
+
+
+class TestDownloadIfChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.server = S3Server(BUCKET_NAME)
+        self.server.keys[METADATA_FILE_NAME] = 'workbook v1'
+        self.server.start()
+        self.bucket = self.server.connect().get_bucket(BUCKET_NAME)
+
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, METADATA_FILE_NAME)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def download(self, key_name=METADATA_FILE_NAME):
+        return s3files.download_if_changed(
+            self.bucket.new_key(key_name),
+            self.file_path
+        )
+
+    def test_first_download(self):
+        etag, size = self.download()
+        self.assertEqual(size, len('workbook v1'))
+        self.assertEqual(open(self.file_path).read(), 'workbook v1')
+        self.assertEqual(open(self.file_path + '.etag').read(), etag)
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            METADATA_FILE_NAME, METADATA_FILE_NAME + '.etag'
+        ])
+
+    def test_unchanged_file_is_not_downloaded(self):
+        etag, _ = self.download()
+
+        # boto removes the download file itself on the 304 response
+        self.assertEqual(self.download(), (etag, None))
+        self.assertEqual(open(self.file_path).read(), 'workbook v1')
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            METADATA_FILE_NAME, METADATA_FILE_NAME + '.etag'
+        ])
+
+    def test_changed_file_is_downloaded(self):
+        old_etag, _ = self.download()
+        self.server.keys[METADATA_FILE_NAME] = 'workbook v2'
+
+        etag, size = self.download()
+        self.assertNotEqual(etag, old_etag)
+        self.assertEqual(size, len('workbook v2'))
+        self.assertEqual(open(self.file_path).read(), 'workbook v2')
+        self.assertEqual(open(self.file_path + '.etag').read(), etag)
+
+    def test_error_is_raised(self):
+        self.download()
+        with self.assertRaises(S3ResponseError) as raised:
+            self.download(u'missing.xlsx')
+        self.assertEqual(raised.exception.status, 404)
+
+        # The cached file is kept, the failed download removed
+        self.assertEqual(open(self.file_path).read(), 'workbook v1')
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            METADATA_FILE_NAME, METADATA_FILE_NAME + '.etag'
+        ])
+
+
+class TestListFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.server = S3Server(BUCKET_NAME)
+        self.server.keys[METADATA_FILE_NAME] = 'workbook'
+        self.server.keys[u'ch.bar.readme.txt'] = 'not a dataset'
+        self.server.keys[u'other/ch.bar.x/file.csv'] = 'other department'
+        for dataset_num in range(5):
+            for file_num in range(500):
+                self.server.keys[
+                    u'ch.bar.dataset%d/file%03d.csv' % (dataset_num, file_num)
+                ] = '%d,%d\n' % (dataset_num, file_num)
+        self.server.keys[u'ch.bar.dataset0/Übersicht.pdf'] = '%PDF'
+        self.server.start()
+        self.bucket = self.server.connect().get_bucket(BUCKET_NAME)
+        del self.server.requests[:]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_files_are_grouped_by_dataset(self):
+        index, file_count = s3files.list_files_by_dataset(
+            self.bucket,
+            DEPARTMENT_BASE
+        )
+        self.assertEqual(file_count, 2502)
+        self.assertEqual(
+            sorted(index),
+            [u'dataset%d' % dataset_num for dataset_num in range(5)]
+        )
+        self.assertEqual(len(index[u'dataset0']), 501)
+        self.assertEqual(len(index[u'dataset4']), 500)
+        self.assertIn(
+            u'ch.bar.dataset0/Übersicht.pdf',
+            [file.key for file in index[u'dataset0']]
+        )
+
+    def test_one_request_per_page(self):
+        s3files.list_files_by_dataset(self.bucket, DEPARTMENT_BASE)
+        # 2502 keys are listed in pages of 1000, no request per file
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_resource_dicts(self):
+        index, _ = s3files.list_files_by_dataset(
+            self.bucket,
+            DEPARTMENT_BASE
+        )
+        resources = s3files.resource_dicts(
+            index[u'dataset0'],
+            DEPARTMENT_BASE + u'dataset0/',
+            FILES_BASE_URL
+        )
+        self.assertEqual(len(resources), 501)
+        self.assertEqual(resources[0], {
+            'url': FILES_BASE_URL + '/ch.bar.dataset0/file000.csv',
+            'name': u'file000.csv',
+            'format': u'csv',
+            'size': 4,
+            'hash': hashlib.md5('0,0\n').hexdigest(),
+            'mimetype': 'text/csv',
+            'last_modified': '2014-03-01T12:00:00'
+        })
+        self.assertEqual(resources[-1]['name'], u'Übersicht.pdf')
+        self.assertEqual(resources[-1]['format'], u'pdf')
+        self.assertEqual(resources[-1]['mimetype'], 'application/pdf')
+        # Nothing but the listing was requested
+        self.assertEqual(len(self.server.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#coding: utf-8
+'''
+Checks that the streaming reader of the SFA workbook returns the same
+values as xlrd for the cell types and layouts found in .xlsx files
+
+Runs without CKAN: nosetests ckanext/sfa/tests/test_workbook.py
+'''
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import xlrd
+
+from ckanext.sfa.tests import load_harvester_module
+
+workbook = load_harvester_module('workbook')
+
+LANG_CODES = ['de', 'fr', 'it', 'en']
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+PACKAGE_NS = 'http://schemas.openxmlformats.org/package/2006'
+TYPE_PREFIX = 'application/vnd.openxmlformats-'
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="' + PACKAGE_NS + '/content-types">'
+    '<Default Extension="rels" ContentType="' + TYPE_PREFIX +
+    'package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="' + TYPE_PREFIX +
+    'officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" ContentType="' + TYPE_PREFIX +
+    'officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '%s</Types>'
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="' + PACKAGE_NS + '/relationships">'
+    '<Relationship Id="rId1" Type="' + REL_NS + '/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+
+# Shared strings with whitespace, preserved whitespace,
+# rich text runs and phonetic runs
+SHARED_STRINGS = [
+    '<si><t>id</t></si>',
+    '<si><t>title</t></si>',
+    '<si><t>tags</t></si>',
+    '<si><t>version</t></si>',
+    '<si><t>  padded  </t></si>',
+    '<si><t xml:space="preserve">  preserved  </t></si>',
+    '<si><r><rPr><b/></rPr><t>rich </t></r>'
+    '<r><t xml:space="preserve">text </t></r><r><t>runs</t></r></si>',
+    '<si><t>Tōkyō</t><rPh sb="0" eb="2"><t>トウキョウ</t></rPh></si>',
+    '<si><t>dataset1</t></si>',
+    '<si><t>a, b; c</t></si>',
+    '<si><t>dataset2</t></si>',
+    '<si><t/></si>',
+]
+
+# Every cell type xlrd knows, sparse rows and columns,
+# and rows and cells without a reference
+SHEET_ROWS = [
+    '<row r="1"><c r="A1" t="s"><v>4</v></c></row>',
+    '<row r="3"><c r="C3" t="s"><v>5</v></c></row>',
+    '<row r="7"><c r="A7" t="s"><v>0</v></c><c r="B7" t="s"><v>1</v></c>'
+    '<c r="C7" t="s"><v>2</v></c><c r="D7" t="s"><v>3</v></c>'
+    '<c r="E7" t="s"><v>1</v></c></row>',
+    '<row r="8"><c r="A8" t="s"><v>8</v></c><c r="B8" t="s"><v>6</v></c>'
+    '<c r="C8" t="s"><v>9</v></c><c r="D8"><v>1.5</v></c>'
+    '<c r="E8" t="b"><v>1</v></c></row>',
+    '<row r="9"/>',
+    '<row r="10"><c r="A10" t="s"><v>10</v></c>'
+    '<c r="B10" t="inlineStr"><is><t>inline</t></is></c>'
+    '<c r="D10" t="str"><f>A10&amp;"x"</f><v>formula</v></c>'
+    '<c r="E10" t="e"><v>#DIV/0!</v></c></row>',
+    '<row><c t="s"><v>7</v></c>'
+    '<c t="inlineStr"><is><r><t>inline </t></r><r><t>rich</t></r></is></c>'
+    '<c><v>42</v></c><c t="b"><v>0</v></c><c t="e"><v>#N/A</v></c></row>',
+    '<row r="13"><c r="A13" t="s"><v>11</v></c><c r="B13"/>'
+    '<c r="C13" t="e"><v>#REF!</v></c><c r="E13"><v>-3E-2</v></c></row>',
+    '<row r="14"><c r="A14" t="s"><v>10</v></c>'
+    '<c r="AB14"><v>7</v></c></row>',
+]
+
+
+def write_xlsx(file_path, sheet_rows, sheet_count=len(LANG_CODES)):
+    '''
+    Write an .xlsx file with the given rows on every sheet
+    '''
+    archive = zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES % ''.join(
+            '<Override PartName="/xl/worksheets/sheet%d.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+            'worksheet+xml"/>' % sheet_num
+            for sheet_num in range(1, sheet_count + 1)
+        ))
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="%s" xmlns:r="%s"><sheets>%s</sheets></workbook>'
+            % (NS, REL_NS, ''.join(
+                '<sheet name="%s" sheetId="%d" r:id="rId%d"/>'
+                % (LANG_CODES[sheet_num - 1], sheet_num, sheet_num)
+                for sheet_num in range(1, sheet_count + 1)
+            ))
+        ))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="%s/relationships">%s'
+            '<Relationship Id="rIdStrings" Type="%s/sharedStrings" '
+            'Target="sharedStrings.xml"/></Relationships>'
+            % (PACKAGE_NS, ''.join(
+                '<Relationship Id="rId%d" Type="%s/worksheet" '
+                'Target="worksheets/sheet%d.xml"/>'
+                % (sheet_num, REL_NS, sheet_num)
+                for sheet_num in range(1, sheet_count + 1)
+            ), REL_NS)
+        ))
+        archive.writestr('xl/sharedStrings.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<sst xmlns="%s" count="%d" uniqueCount="%d">%s</sst>'
+            % (NS, len(SHARED_STRINGS), len(SHARED_STRINGS),
+               ''.join(SHARED_STRINGS))
+        ))
+        for sheet_num in range(1, sheet_count + 1):
+            archive.writestr('xl/worksheets/sheet%d.xml' % sheet_num, (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="%s"><sheetData>%s</sheetData></worksheet>'
+                % (NS, ''.join(sheet_rows))
+            ))
+    finally:
+        archive.close()
+
+
+def strip_row(values):
+    '''
+    Drop the empty cells at the end of a row, xlrd pads
+    all rows of a sheet to the same length
+    '''
+    values = list(values)
+    while values and values[-1] == u'':
+        values.pop()
+    return values
+
+
+class TestXLSXRowReader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'workbook.xlsx')
+        write_xlsx(self.file_path, SHEET_ROWS)
+        self.xlrd_book = xlrd.open_workbook(self.file_path)
+
+    def tearDown(self):
+        self.xlrd_book.release_resources()
+        shutil.rmtree(self.directory)
+
+    def xlrd_rows(self, sheet_index):
+        sheet = self.xlrd_book.sheet_by_index(sheet_index)
+        return [
+            strip_row(sheet.row_values(row_num))
+            for row_num in range(sheet.nrows)
+        ]
+
+    def test_rows_match_xlrd(self):
+        reader = workbook.XLSXRowReader(self.file_path)
+        for sheet_index in range(len(LANG_CODES)):
+            rows = [strip_row(row) for row in reader.iter_rows(sheet_index)]
+            self.assertEqual(rows, self.xlrd_rows(sheet_index))
+
+    def test_value_types_match_xlrd(self):
+        def value_type(value):
+            # xlrd returns empty cells as '' instead of u''
+            return basestring if isinstance(value, basestring) \
+                else type(value)
+
+        reader = workbook.XLSXRowReader(self.file_path)
+        for row, xlrd_row in zip(reader.iter_rows(0), self.xlrd_rows(0)):
+            self.assertEqual(
+                [value_type(value) for value in strip_row(row)],
+                [value_type(value) for value in xlrd_row]
+            )
+
+    def test_workbook_rows_match_xlrd(self):
+        sfa_workbook = workbook.SFAWorkbook(self.file_path, LANG_CODES)
+        for sheet_index, lang_code in enumerate(LANG_CODES):
+            xlrd_rows = self.xlrd_rows(sheet_index)
+            header = xlrd_rows[workbook.SFAWorkbook.HEADER_ROW]
+            expected = [
+                dict(zip(header, row + [u''] * (len(header) - len(row))))
+                for row in xlrd_rows[workbook.SFAWorkbook.FIRST_DATA_ROW:]
+                if any(row)
+            ]
+            self.assertEqual(list(sfa_workbook.iter_rows(lang_code)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()